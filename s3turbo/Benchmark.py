@@ -0,0 +1,293 @@
+from __future__ import print_function
+import os, sys, time, random, shutil, tempfile, fnmatch, resource, platform
+import subprocess, multiprocessing
+
+from s3turbo.S3Image      import S3Image
+from s3turbo.DirEntry     import DirEntry
+from s3turbo.Fat12        import Fat12
+from s3turbo.MSCEIMessage import MSCEIMessage
+from s3turbo.Util         import conv7_8, conv7_8_all, conv8_7_all
+
+# file size ranges in bytes for synthetic trees
+DISTRIBUTIONS = {
+    'small': (64,   4096),
+    'mixed': (64,   65536),
+    'large': (32768,262144),
+}
+
+# fills directory path with random files up to fill*capacity bytes
+def synthetic_tree(path,fill=0.5,distribution='mixed',seed=0):
+    rnd = random.Random(seed)
+    lo, hi = DISTRIBUTIONS[distribution]
+    bs = S3Image().bs
+    # leave room for directory clusters and per-file rounding
+    budget = int(fill*(bs.disk_size()-bs.root_offset())*0.9)
+    n = 0
+    while True:
+        size = rnd.randint(lo,hi)
+        budget -= (size/bs.cluster_size()+1)*bs.cluster_size()
+        if budget < 0: break
+        dirname = os.path.join(path,'DIR%02d' % (n/24),'SUB%d' % (n%3))
+        if not os.path.exists(dirname): os.makedirs(dirname)
+        with open(os.path.join(dirname,'F%05d.PRG' % n),'wb') as f:
+            f.write(os.urandom(size))
+        n += 1
+    return n
+
+def synthetic_image(filename,fill=0.5,distribution='mixed',seed=0):
+    tmpdir = tempfile.mkdtemp(prefix='s3bench')
+    try:
+        synthetic_tree(tmpdir,fill,distribution,seed)
+        img = S3Image()
+        img.add_directory(tmpdir)
+        with open(filename,'wb') as f:
+            img.write(f)
+    finally:
+        shutil.rmtree(tmpdir)
+
+# F_DPKT messages carrying size random bytes, packets of ngroups*7 bytes
+def synthetic_dump(size,ngroups=32):
+    data = os.urandom(size)
+    msgs = []
+    for pos in xrange(0,size,7*ngroups):
+        payload = conv8_7_all(data[pos:pos+7*ngroups])
+        msgs.append(MSCEIMessage(*([ len(payload)/8 ] + list(payload)),
+                                 fromName="F_DPKT").raw())
+    return data, msgs
+
+def maxrss():
+    # kilobytes on Linux, bytes on Mac OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': rss /= 1024
+    return rss
+
+# runs func(state) after setup() in a child process, so that the memory
+# high-water mark belongs to this benchmark only
+def measure(conn,setup,func,warmup,repeat):
+    try:
+        state = setup() if setup else None
+        rss = maxrss()
+        for i in xrange(warmup): func(state)
+        times = []
+        for i in xrange(repeat):
+            start = time.time()
+            func(state)
+            times.append(time.time()-start)
+        times.sort()
+        conn.send({
+            'min':         times[0],
+            'median':      times[len(times)/2],
+            'mean':        sum(times)/len(times),
+            'max':         times[-1],
+            'repeat':      repeat,
+            'warmup':      warmup,
+            'maxrss_kb':   maxrss(),
+            'delta_rss_kb': maxrss()-rss,
+        })
+    except Exception, e:
+        conn.send({ 'error': "%s: %s" % (e.__class__.__name__,str(e)) })
+
+class Benchmark(object):
+    def __init__(self,workdir=None,warmup=1,repeat=5,pattern='*',
+                 verbose=False):
+        self.workdir = workdir if workdir else tempfile.mkdtemp(
+            prefix='s3bench')
+        if not os.path.exists(self.workdir): os.makedirs(self.workdir)
+        self.warmup  = warmup
+        self.repeat  = repeat
+        self.pattern = pattern
+        self.verbose = verbose
+        self.results = {}
+
+    # any of the names matches the pattern
+    def selected(self,*names):
+        return any([ fnmatch.fnmatch(name,self.pattern) for name in names ])
+
+    def run(self,name,func,setup=None):
+        if not self.selected(name): return
+        parent, child = multiprocessing.Pipe()
+        proc = multiprocessing.Process(
+            target=measure,
+            args=(child,setup,func,self.warmup,self.repeat))
+        proc.start()
+        result = parent.recv()
+        proc.join()
+        self.results[name] = result
+        if self.verbose:
+            if 'error' in result:
+                print("%-40s %s" % (name,result['error']))
+            else:
+                print("%-40s %10.4f s %10d kB" %
+                      (name,result['median'],result['maxrss_kb']))
+
+    def image(self,fill,distribution):
+        filename = os.path.join(self.workdir,'%s_%d.img' %
+                                (distribution,int(fill*100)))
+        if not os.path.exists(filename):
+            synthetic_image(filename,fill,distribution)
+        return filename
+
+    def tree(self,fill,distribution):
+        path = os.path.join(self.workdir,'%s_%d' %
+                            (distribution,int(fill*100)))
+        if not os.path.exists(path):
+            os.makedirs(path)
+            synthetic_tree(path,fill,distribution)
+        return path
+
+    def run_image(self,fill,distribution):
+        tag = '%s_%d' % (distribution,int(fill*100))
+        # synthetic image and tree are only built if their runs are selected
+        if self.selected(*[ 'image.%s.%s' % (name,tag) for name in [
+                'read', 'read_contiguous', 'read_lazy', 'write',
+                'extract_all', 'test_file' ] ]):
+            fn  = self.image(fill,distribution)
+            out = os.path.join(self.workdir,'out.img')
+            ext = os.path.join(self.workdir,'extract')
+            def load(**kwargs):
+                img = S3Image(contiguous=kwargs.pop('contiguous',False))
+                img.read_from_file(fn,**kwargs)
+                return img
+            def extract(img):
+                if os.path.exists(ext): shutil.rmtree(ext)
+                img.extract_all(ext)
+            self.run('image.read.%s' % tag,
+                     lambda s: load())
+            self.run('image.read_contiguous.%s' % tag,
+                     lambda s: load(contiguous=True))
+            self.run('image.read_lazy.%s' % tag,
+                     lambda s: load(lazy=True).close())
+            def write(img):
+                with open(out,'wb') as f:
+                    img.write(f)
+            self.run('image.write.%s' % tag, write, setup=load)
+            self.run('image.extract_all.%s' % tag, extract, setup=load)
+            self.run('image.test_file.%s' % tag,
+                     lambda img: img.test_file(fn), setup=load)
+        if self.selected('image.add_directory.%s' % tag):
+            tree = self.tree(fill,distribution)
+            self.run('image.add_directory.%s' % tag,
+                     lambda s: S3Image().add_directory(tree))
+
+    def run_fat(self):
+        def fragmented():
+            fat = S3Image().fat
+            chains = [ fat.create_chain(3) for i in xrange(400) ]
+            for c in chains[::2]: fat.free_chain(c[0])
+            return fat
+        def create(fat):
+            chains = [ fat.create_chain(2) for i in xrange(200) ]
+            for c in chains: fat.free_chain(c[0])
+        self.run('fat.create_chain.empty', create,
+                 setup=lambda: S3Image().fat)
+        self.run('fat.create_chain.fragmented', create, setup=fragmented)
+        self.run('fat.roundtrip',
+                 lambda fat: Fat12(fat.to_raw()), setup=fragmented)
+
+    # 1000 directory clusters of 32 entries
+    def run_direntry(self,n=1000):
+        def cluster():
+            de = DirEntry(start=2,size=1000)
+            de.encode_name('FILE.PRG')
+            return de.to_raw()*32
+        def from_raw(data):
+            for j in xrange(n):
+                [ DirEntry(data=data[i:i+32]) for i in xrange(0,len(data),32) ]
+        def from_cluster(data):
+            for j in xrange(n):
+                DirEntry.from_cluster(data)
+        def to_raw(des):
+            for j in xrange(n):
+                [ de.to_raw() for de in des ]
+        self.run('direntry.from_raw', from_raw, setup=cluster)
+        self.run('direntry.from_cluster', from_cluster, setup=cluster)
+        self.run('direntry.to_raw', to_raw,
+                 setup=lambda: DirEntry.from_cluster(cluster()))
+
+    def run_codec(self,size=2097060):
+        def stream():
+            return synthetic_dump(size)[1]
+        def groups(msgs):
+            for m in msgs:
+                data = []
+                for i in xrange(m[5]):
+                    data += conv7_8(m[6+8*i:14+8*i])
+        def batch(msgs):
+            for m in msgs:
+                conv7_8_all(m[6:6+8*m[5]])
+        self.run('codec.conv7_8', groups, setup=stream)
+        self.run('codec.conv7_8_all', batch, setup=stream)
+        self.run('codec.conv8_7_all',
+                 lambda data: conv8_7_all(data),
+                 setup=lambda: os.urandom(size))
+
+    # file dump through the device emulator and the SysEx parser
+    def run_transfer(self,fill,distribution):
+        tag = '%s_%d' % (distribution,int(fill*100))
+        if not self.selected('transfer.file_dump.%s' % tag): return
+        fn  = self.image(fill,distribution)
+        def setup():
+            # dump file is written to the current directory
+            os.chdir(self.workdir)
+            img = S3Image()
+            img.read_from_file(fn)
+            dirs, files = img.read_dir(img.lookup(['DIR00','SUB0']).start)
+            f = max(files,key=lambda de: de.size)
+            return img, f
+        def transfer(state):
+            from s3turbo.S3Emulator  import S3Emulator
+            from s3turbo.SysExParser import SysExParser
+            from s3turbo.Util        import str2file, str2hex
+            img, f = state
+            midi = S3Emulator(img)
+            parser = SysExParser(send_func=midi.send)
+            parser.sendSysEx(MSCEIMessage(
+                *(str2file(f.name())+str2hex('A:\\DIR00\\SUB0\\')),
+                fromName="F_DREQ"))
+            devnull = open(os.devnull,'w')
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                while midi.poll(0):
+                    timestamp, msg = midi.recv()
+                    if not parser.parse(msg,timestamp): break
+                parser.closeDumpFile()
+            finally:
+                sys.stdout = stdout
+        self.run('transfer.file_dump.%s' % tag, transfer, setup=setup)
+
+    def run_all(self,fills=[0.1,0.5,0.9],distributions=['small','mixed',
+                                                          'large']):
+        for d in distributions:
+            for fill in fills:
+                self.run_image(fill,d)
+        self.run_fat()
+        self.run_direntry()
+        self.run_codec()
+        self.run_transfer(0.5,'mixed')
+
+    def to_dict(self):
+        try:
+            commit = subprocess.check_output(
+                ['git','rev-parse','HEAD'],stderr=open(os.devnull,'w'),
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+        except Exception:
+            commit = None
+        return {
+            'commit':  commit,
+            'time':    time.strftime("%Y-%m-%d %H:%M:%S"),
+            'python':  platform.python_version(),
+            'machine': platform.machine(),
+            'results': self.results,
+        }
+
+    def cleanup(self):
+        shutil.rmtree(self.workdir,True)
+
+# prints median ratios of two result sets, > 1 means new is slower
+def compare(old,new,file=sys.stdout):
+    for name in sorted(new['results']):
+        n, o = new['results'][name], old['results'].get(name)
+        if not o or 'error' in o or 'error' in n: continue
+        print("%-40s %10.4f s %10.4f s %6.2fx" %
+              (name,o['median'],n['median'],n['median']/o['median']),
+              file=file)
@@ -1,34 +1,54 @@
 from __future__ import print_function
-import cStringIO, sys, collections, re
+import sys, collections, re
 from s3turbo.Util import CharHandler, ByteHandler, WordHandler, LongHandler
-from s3turbo.Util import decode_path, encode_path
+from s3turbo.Util import decode_path, encode_path, compile_struct
 
 class DirEntry(object):
+    __slots__ = [
+        'shortname', 'shortext', 'attr', 'userattr', 'undelchar', 'ctime',
+        'cdate', 'adate', 'access', 'mtime', 'mdate', 'start', 'size',
+    ]
+
     def __init__(self,**kwargs):
         if 'data' in kwargs.keys():
             self.from_raw(kwargs['data'])
         else:
             for name,handler in DirEntry.attributes.iteritems():
-                self.__setattr__(name,kwargs.get(name,handler.default))
+                setattr(self,name,kwargs.get(name,handler.default))
 
     def reset(self):
         for name,handler in DirEntry.attributes.iteritems():
-            self.__setattr__(name,handler.default)
-        
-    def from_raw(self,data):
-        if isinstance(data,str): data = cStringIO.StringIO(data)
-        for name,handler in DirEntry.attributes.iteritems():
-            try:
-                self.__setattr__(name,handler.read(data))
-            except Exception, e:
-                raise Exception("DirEntry.from_raw: error while parsing '%s':\n"
-                                " %s" % (name,str(e)))
-        
+            setattr(self,name,handler.default)
+
+    def from_raw(self,data,offset=0):
+        if hasattr(data,'read'): data = data.read(DirEntry.SIZE)
+        try:
+            values = DirEntry.struct.unpack_from(data,offset)
+        except Exception, e:
+            raise Exception("DirEntry.from_raw: error while parsing:\n"
+                            " %s" % str(e))
+        for name,value in zip(DirEntry.__slots__,values):
+            setattr(self,name,value)
+
     def to_raw(self):
-        data = cStringIO.StringIO()
-        for name,handler in DirEntry.attributes.iteritems():
-            data.write(handler.write(self.__getattribute__(name)))
-        return data.getvalue()
+        return DirEntry.struct.pack(*self.values())
+
+    def pack_into(self,buf,offset=0):
+        DirEntry.struct.pack_into(buf,offset,*self.values())
+
+    def values(self):
+        return [ getattr(self,name) for name in DirEntry.__slots__ ]
+
+    # decodes all entries of a directory cluster up to the first empty one
+    @staticmethod
+    def from_cluster(data):
+        entries = []
+        for pos in xrange(0,len(data)-DirEntry.SIZE+1,DirEntry.SIZE):
+            de = DirEntry.__new__(DirEntry)
+            de.from_raw(data,pos)
+            if de.is_empty(): break
+            entries.append(de)
+        return entries
 
     def is_empty(self):
         return ord(self.shortname[0]) == DirEntry.TYPE_EMPTY
@@ -74,7 +94,7 @@ class DirEntry(object):
 
     def dump(self,file=sys.stdout):
         for name in DirEntry.attributes.iterkeys():
-            print("%-20s: %s" % (name,repr(self.__getattribute__(name))))
+            print("%-20s: %s" % (name,repr(getattr(self,name))))
 
 DirEntry.attributes = collections.OrderedDict([
     ('shortname', CharHandler(b'\x00'*8)),
@@ -92,6 +112,8 @@ DirEntry.attributes = collections.OrderedDict([
     ('size',      LongHandler(0)),
 ])
 
+DirEntry.struct = compile_struct(DirEntry.attributes)
+
 DirEntry.known_extensions = [
     'TXL', 'LOD', 'PRG',
 ]
@@ -1,5 +1,5 @@
 from __future__ import print_function
-import sys
+import sys, array
 
 def _check_cluster(cluster):
     if cluster in [0,1]:
@@ -13,70 +13,146 @@ def _pack(double):
     raw += chr(double[1] >> 4)
     return raw
 
-def _unpack(raw):
-    return ((ord(raw[0]) | (ord(raw[1])&0xf)<<8),
-            (ord(raw[1]) >> 4 | (ord(raw[2]) << 4)))
+# decodes whole packed table, entries are stored as pairs in 3 bytes
+def _unpack_all(raw):
+    b0, b1, b2 = raw[0::3], raw[1::3], raw[2::3]
+    table = array.array('H',[0]*(len(b0)*2))
+    table[0::2] = array.array('H',[ l | (m & 0xf) << 8
+                                    for l,m in zip(b0,b1) ])
+    table[1::2] = array.array('H',[ m >> 4 | h << 4
+                                    for m,h in zip(b1,b2) ])
+    return table
 
 class Fat12(object):
     def __init__(self,rawdata=None,rawsize=None):
+        self.nclusters = None
+        self.cylinder  = None
+        self.offset    = 0
         if rawdata is None:
             rawdata = _pack((Fat12.FATID,Fat12.TERM))
         self.from_raw(rawdata,rawsize)
+
+    # restricts allocation to clusters 2..nclusters+1, chains fitting into
+    # one cylinder are kept from crossing cylinder boundaries if possible.
+    # offset is the number of clusters on the disk preceding cluster 2
+    def set_geometry(self,nclusters,clusterspercylinder=None,offset=0):
+        self.nclusters = nclusters
+        self.cylinder  = clusterspercylinder
+        self.offset    = offset
+        self.init_allocator()
+
+    def init_allocator(self):
+        end = self.nentries
+        if not self.nclusters is None:
+            end = min(end,self.nclusters+2)
+        # free map holds one byte per cluster, 1 if cluster is empty
+        self.free = bytearray(self.nentries)
+        self.free[2:end] = bytearray([ v == 0 for v in self.decode()[2:end] ])
+        self.nfree  = self.free.count(b'\x01')
+        self.cursor = 2
+
+    def mark(self,cluster,value):
+        if self.free[cluster] and value != 0:
+            self.free[cluster] = 0
+            self.nfree -= 1
+        elif value == 0 and not self.free[cluster] and \
+             (self.nclusters is None or cluster < self.nclusters+2):
+            self.free[cluster] = 1
+            self.nfree += 1
+        self.set(cluster,value)
         
     def from_raw(self,rawdata,rawsize=None):
         if not rawsize is None and rawsize > len(rawdata):
-            rawdata = rawdata.ljust(rawsize-len(rawdata),b'\x00')
+            rawdata = rawdata.ljust(rawsize,b'\x00')
         if len(rawdata) % 3 != 0:
             raise Exception("raw data size must be multiple of 3")
         if len(rawdata) < 3:
             raise Exception("raw data size must be at least 3 bytes")
-        self.data = []
-        for i in range(0,len(rawdata),3):
-            self.data += list(_unpack(rawdata[i:i+3]))
-        if self.data[0] != Fat12.FATID:
+        # packed 12-bit table, entries are accessed in place
+        self.raw      = bytearray(rawdata)
+        self.nentries = len(self.raw)*2/3
+        if self.get(0) != Fat12.FATID:
             raise Exception("expected FAT id %x, got %x" %
-                            (Fat12.FATID,self.data[0]))
-        if self.data[1] != Fat12.TERM:
+                            (Fat12.FATID,self.get(0)))
+        if self.get(1) != Fat12.TERM:
             raise Exception("expected terminator %x, got %x" %
-                            (Fat12.TERM,self.data[1]))
+                            (Fat12.TERM,self.get(1)))
+        self.init_allocator()
         
     def to_raw(self):
-        raw = ''
-        for i in range(0,len(self.data),2):
-            raw += _pack(self.data[i:i+2])
-        return raw
+        return str(self.raw)
+
+    def decode(self):
+        return _unpack_all(self.raw)
 
     def get(self,cluster):
-        if cluster >= len(self.data):
+        if cluster >= self.nentries:
+            raise Exception("invalid cluster %d: out of bounds" % cluster)
+        pos = cluster + (cluster >> 1)
+        if cluster & 1:
+            return self.raw[pos] >> 4 | self.raw[pos+1] << 4
+        return self.raw[pos] | (self.raw[pos+1] & 0xf) << 8
+
+    def set(self,cluster,value):
+        if cluster >= self.nentries:
             raise Exception("invalid cluster %d: out of bounds" % cluster)
-        return self.data[cluster]
+        pos = cluster + (cluster >> 1)
+        if cluster & 1:
+            self.raw[pos]   = self.raw[pos] & 0xf | (value & 0xf) << 4
+            self.raw[pos+1] = value >> 4
+        else:
+            self.raw[pos]   = value & 0xff
+            self.raw[pos+1] = self.raw[pos+1] & 0xf0 | value >> 8
 
     def next_cluster(self,cluster):
         _check_cluster(cluster)
         if cluster == Fat12.TERM:
             raise Exception("end of chain reached")
-        if cluster >= len(self.data):
-            raise Exception("invalid cluster %d: out of bounds" % cluster)
-        return self.data[cluster]
+        return self.get(cluster)
         
     def find_empty_cluster(self,start=2,throw=True):
-        for i, v in enumerate(self.data[start:],start):
-            if v == 0: return i
-        else:
-            if throw:
-                raise Exception("find_empty_cluster: no empty clusters left")
-            else:
-                return Fat12.TERM
+        i = self.free.find(b'\x01',start)
+        if i >= 0: return i
+        if throw:
+            raise Exception("find_empty_cluster: no empty clusters left")
+        return Fat12.TERM
 
     def nempty_clusters(self,maxsize=None):
-        if maxsize is None:
-            end = len(self.data)
-        else:
-            end = maxsize+2
-        n=0
-        for c in self.data[2:end]:
-            if c == 0: n +=1
-        return n
+        if maxsize is None or maxsize+2 >= self.nentries or \
+           (not self.nclusters is None and maxsize >= self.nclusters):
+            return self.nfree
+        return self.free.count(b'\x01',2,maxsize+2)
+
+    def cylinder_of(self,cluster):
+        return (cluster-2+self.offset)/self.cylinder
+
+    def find_extent(self,nclusters):
+        run = b'\x01'*nclusters
+        start = self.free.find(run,self.cursor)
+        if start < 0:
+            start = self.free.find(run,2)
+        if start < 0:
+            return None
+        # prefer next cylinder if the extent would cross a boundary
+        if self.cylinder and nclusters <= self.cylinder and \
+           self.cylinder_of(start) != self.cylinder_of(start+nclusters-1):
+            next = start + self.cylinder - \
+                   (start-2+self.offset) % self.cylinder
+            if self.free.find(run,next,next+nclusters) == next:
+                start = next
+        return range(start,start+nclusters)
+
+    def find_clusters(self,nclusters):
+        chain = []
+        pos = self.cursor
+        while len(chain) != nclusters:
+            pos = self.free.find(b'\x01',pos)
+            if pos < 0:
+                pos = 2
+                continue
+            chain.append(pos)
+            pos += 1
+        return chain
 
     def get_chain(self,start):
         chain = [ start ]
@@ -87,40 +163,37 @@ class Fat12(object):
         return chain
 
     def free_chain(self,start):
-        next = _check_cluster(self.data[start])
-        self.data[start] = 0
+        next = _check_cluster(self.get(start))
+        self.mark(start,0)
         while next != Fat12.TERM:
-            tmp = _check_cluster(self.data[next])
-            self.data[next] = 0
+            tmp = _check_cluster(self.get(next))
+            self.mark(next,0)
             next = tmp
 
     def create_chain(self,nclusters):
-        chain = []
-        start = self.find_empty_cluster(throw=False)
-        if start == Fat12.TERM:
+        if self.nfree == 0:
             raise Exception("cannnot create chain, no empty clusters left")
-        self.data[start] = Fat12.TERM
-        chain.append(start)
-        last = start
-        next = self.find_empty_cluster(throw=False)
-        while len(chain) != nclusters:
-            if next == Fat12.TERM:
-                raise Exception("cannot extend chain")
-            self.data[last] = next
-            self.data[next] = Fat12.TERM
-            chain.append(next)
-            last = next
-            next = self.find_empty_cluster(throw=False)
+        if nclusters > self.nfree:
+            raise Exception("cannot create chain of %d clusters, only %d"
+                            " empty clusters left" % (nclusters,self.nfree))
+        # contiguous extent first, scattered clusters otherwise
+        chain = self.find_extent(nclusters)
+        if chain is None:
+            chain = self.find_clusters(nclusters)
+        for c,next in zip(chain,chain[1:]):
+            self.mark(c,next)
+        self.mark(chain[-1],Fat12.TERM)
+        self.cursor = chain[-1]+1
         return chain
 
     def extend_chain(self,start,nclusters=1):
         oldchain = self.get_chain(start)
         newchain = self.create_chain(nclusters)
-        self.data[oldchain[-1]] = newchain[0]
+        self.mark(oldchain[-1],newchain[0])
         return newchain
     
     def dump(self,file=sys.stdout):
-        for i,v in enumerate(self.data):
+        for i,v in enumerate(self.decode()):
             if i%16==0: print('\n0x%03x:' % i,end=" ")
             print('0x%03x' % v,end=" ")
         print()
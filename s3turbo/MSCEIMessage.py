@@ -1,4 +1,5 @@
 from s3turbo.S3Turbo import S3Functions, S3Exception
+from s3turbo.Util    import xor_checksum
 
 # S3 message skeleton
 class MSCEIMessage(object):
@@ -27,22 +28,36 @@ class MSCEIMessage(object):
         self.appendChecksum = True \
                               if kwargs.get("forceChecksum", False) \
                               else appendChecksum
+        self.cached = None
         
     def msg(self, time=0):
         return (time, self.raw())
 
     def raw(self):
-        ret = []
-        ret.append(self.magic)
-        ret.append(self.vendor)
-        ret.append((self.func << 4) | self.chan)
-        ret.append(self.subfunc)
-        ret.append(self.reqchan)
+        return list(self.frozen())
+
+    # message as immutable tuple of ints, built on first use. Unlike str it
+    # can be passed to all MIDI backends and compared bytewise
+    def frozen(self):
+        if self.cached: return self.cached
+        ret = bytearray([ self.magic, self.vendor,
+                          (self.func << 4) | self.chan, self.subfunc,
+                          self.reqchan ])
         if len(self.data):
-            ret += self.data
+            ret += bytearray(self.data)
             if self.appendChecksum:
-                checksum = 0
-                for b in ret[1:]: checksum ^= b
-                ret.append(checksum)
+                ret.append(xor_checksum(buffer(ret,1)))
         ret.append(self.term)
+        self.cached = tuple(ret)
+        return self.cached
+
+    # shared message without parameters, e.g. for F_ACK or D_WAIT
+    @staticmethod
+    def handshake(name):
+        ret = MSCEIMessage.handshakes.get(name)
+        if ret is None:
+            ret = MSCEIMessage.handshakes[name] = \
+                  MSCEIMessage(fromName=name).frozen()
         return ret
+
+MSCEIMessage.handshakes = {}
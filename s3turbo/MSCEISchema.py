@@ -0,0 +1,125 @@
+import collections, struct
+
+from s3turbo.Util import conv7_8_all, xor_checksum
+
+# declarative layout of an MSCEI message, segments are read in order starting
+# after the function bytes:
+#   ('byte',    name)          single byte
+#   ('text',    name, length)  fixed length string
+#   ('cstring', name)          zero-terminated string
+#   ('groups',  name, n, fmt, fields)
+#                              7 bit encoded block of n groups, n can be the
+#                              name of an earlier byte segment. It is decoded
+#                              to name and unpacked with fmt into fields, a
+#                              (field,count) tuple collects count values
+# Records are namedtuples with all fields plus the received checksum, the
+# calculated one, their match and the offset of the checksum byte
+class MSCEISchema(object):
+    def __init__(self,fname,segments,offset=5):
+        self.fname    = fname
+        self.segments = []
+        self.offset   = offset
+        fields = []
+        for seg in segments:
+            fields.append(seg[1])
+            if seg[0] == 'groups':
+                kind, name, n, fmt, unpacked = seg
+                codec = struct.Struct(fmt) if fmt else None
+                counts = []
+                for f in unpacked or []:
+                    if isinstance(f,tuple):
+                        fields.append(f[0])
+                        counts.append(f[1])
+                    else:
+                        fields.append(f)
+                        counts.append(None)
+                seg = (kind, name, n, codec, counts)
+            self.segments.append(seg)
+        fields += [ 'checksum', 'calculated', 'valid', 'end' ]
+        self.record = collections.namedtuple('MSCEIRecord',fields)
+
+    def decode(self,msg):
+        if not isinstance(msg,bytearray): msg = bytearray(msg)
+        view   = memoryview(msg)
+        pos    = self.offset
+        values = []
+        count  = {}
+        for seg in self.segments:
+            kind = seg[0]
+            if kind == 'byte':
+                values.append(msg[pos])
+                count[seg[1]] = msg[pos]
+                pos += 1
+            elif kind == 'text':
+                values.append(view[pos:pos+seg[2]].tobytes())
+                pos += seg[2]
+            elif kind == 'cstring':
+                end = msg.index(b'\x00',pos)
+                values.append(view[pos:end].tobytes())
+                pos = end+1
+            else:
+                kind, name, n, codec, counts = seg
+                if not isinstance(n,int): n = count[n]
+                data = conv7_8_all(view[pos:pos+8*n])
+                values.append(data)
+                pos += 8*n
+                if codec is None: continue
+                unpacked = codec.unpack_from(data)
+                i = 0
+                for c in counts:
+                    if c is None:
+                        values.append(unpacked[i])
+                        i += 1
+                    else:
+                        values.append(unpacked[i:i+c])
+                        i += c
+        calculated = xor_checksum(view[1:pos])
+        values += [ msg[pos], calculated, msg[pos] == calculated, pos ]
+        return self.record._make(values)
+
+# record for message of function fname, None if there is no schema
+def decode(fname,msg):
+    schema = MSCEISchema.schemas.get(fname)
+    if schema is None: return None
+    return schema.decode(msg)
+
+def _header(first,second):
+    return [
+        ('text',    'filename', 11),
+        ('byte',    'flags'),
+        ('groups',  'data', 2, '>HHIBBBBB',
+         [ first, second, 'length', 'DeviceClass', 'DeviceSubClass',
+           'DeviceRelease', 'FileType', 'FileFormat' ]),
+        ('cstring', 'location'),
+    ]
+
+_packet = [
+    ('byte',   'noctets'),
+    ('groups', 'data', 'noctets', None, None),
+]
+
+_answer = [
+    ('byte',   'type'),
+    ('byte',   'bank'),
+    ('byte',   'perf'),
+    ('text',   'filename1', 11),
+    ('byte',   'fileflags'),
+    ('groups', 'data', 2, '>HHIBB',
+     [ 'time', 'date', 'length', 'InstrID', 'FileID' ]),
+    ('text',   'filename2', 11),
+]
+
+MSCEISchema.schemas = dict([ (fname, MSCEISchema(fname,segments)) for
+                             fname, segments in [
+    ("STAT_ANSWER", [
+        ('groups', 'data', 3, '>BBBxIIIBBBB',
+         [ 'iClass', 'iSubClass', 'iRelease', 'TotalMem', 'FreeMem',
+           'FreeSampleMem', ('ReadyFor',2), ('ActBankPerf',2) ]),
+    ]),
+    ("F_DHDR",      _header('time','date')),
+    ("DIR_HDR",     _header('date','time')),
+    ("F_DPKT",      _packet),
+    ("DATA_DUMP",   _packet),
+    ("DATA_HEADER", _answer),
+    ("DIR_ANSWER",  _answer),
+]])
@@ -0,0 +1,40 @@
+# message prefix filters compiled into a table indexed by status byte, counts
+# dropped messages per filter. As before, a message matches a filter if one
+# is a prefix of the other
+class MessageFilter(object):
+    def __init__(self,filters=[]):
+        self.filters = [ bytearray(f) for f in filters if len(f) ]
+        self.dropped = [ 0 ] * len(self.filters)
+        # status byte -> list of (rest of prefix, filter index)
+        self.table   = [ None ] * 256
+        for i, f in enumerate(self.filters):
+            if self.table[f[0]] is None: self.table[f[0]] = []
+            self.table[f[0]].append((f[1:],i))
+
+    def __len__(self):
+        return len(self.filters)
+
+    # msg can be any sequence of ints, checks before copying it
+    def match(self,msg):
+        entries = self.table[msg[0]]
+        if entries is None: return False
+        for rest, i in entries:
+            if len(rest) and len(msg) > 1:
+                head = msg[1:1+len(rest)]
+                if not isinstance(head,bytearray): head = bytearray(head)
+                if head != rest[:len(head)]: continue
+            self.dropped[i] += 1
+            return True
+        return False
+
+    def names(self):
+        return [ ''.join([ '%02x' % b for b in f ]) for f in self.filters ]
+
+    def to_dict(self):
+        return dict(zip(self.names(),self.dropped))
+
+    # stores drop counters in telemetry as filtered_<prefix in hex>
+    def record(self,telemetry,dropped=None):
+        if dropped is None: dropped = self.dropped
+        for name, n in zip(self.names(),dropped):
+            telemetry.counters['filtered_'+name] = n
@@ -1,6 +1,5 @@
-import struct
-from s3turbo.Util import checksum, conv7_8, noop, list2str
-from s3turbo.Util import hexdump, time2str, date2str, pretty_path
+from s3turbo.MSCEISchema import decode
+from s3turbo.Util        import noop, hexdump, time2str, date2str, pretty_path
 
 class MessagePrinter(object):
     def __init__(self,debug=False):
@@ -10,7 +9,7 @@ class MessagePrinter(object):
             # FILE FUNCTIONS  FILE_F
             "F_DHDR"     : self.printFileDumpHeader,
             "F_DPKT"     : self.printFileDumpDataBlock,
-            "DIR_HDR"    : self.printDirHeader,
+            "DIR_HDR"    : self.printFileDumpHeader,
             "F_ERR"      : self.printError,
             # EDIT FUNCTIONS  EDIT_F
             "_UPDATE"    : self.printUpdate,
@@ -23,13 +22,20 @@ class MessagePrinter(object):
             "D_WAIT"     : noop,
         }
 
-    def handle(self,fname,msg):
-        for name, handler in self.handlers.iteritems():
-            if name == fname:
-                handler(msg)
-                return
-            
-    def printError(self,msg):
+    # rec is the decoded message if the caller has it already
+    def handle(self,fname,msg,rec=None):
+        handler = self.handlers.get(fname)
+        if not handler: return
+        if rec is None: rec = decode(fname,msg)
+        handler(msg,rec)
+
+    def printChecksum(self,msg,rec):
+        print "  checksum:", hex(rec.checksum), \
+            "(calculated 0x%x)" % rec.calculated
+        if msg[rec.end+1] != 0xF7:
+            print "  remaining bytes:", [hex(b) for b in msg[rec.end+1:]]
+
+    def printError(self,msg,rec=None):
         errs = [ 'No_error', 'Job_invalid', 'Job_in_use', 'Operation_invalid',
                  'Drive_invalid', 'Drive_no_write',
                  'Media_invalid', 'Media_corrupt', 'Media_protected',
@@ -46,61 +52,42 @@ class MessagePrinter(object):
         else:
             print "Unknown error"
 
-    def printUpdate(self,msg):
+    def printUpdate(self,msg,rec=None):
         family = msg[4]
         group  = msg[5]
         print "family:", family
         print "group: ", group
         
-    def printStatusAnswer(self,msg):
-        offset=5
-        data = []
-        for i in xrange(3):
-            data += conv7_8(msg[offset:offset+8])
-            offset += 8
+    def printStatusAnswer(self,msg,rec):
         datadict = {
-            "iClass"       : data[0],
-            "iSubClass"    : data[1],
-            "iRelease"     : data[2],
-            "TotalMem"     : struct.unpack('>I',list2str(data[4:8]))[0],
-            "FreeMem"      : struct.unpack('>I',list2str(data[8:12]))[0],
-            "FreeSampleMem": struct.unpack('>I',list2str(data[12:16]))[0],
-            "ReadyFor"     : tuple(data[16:18]),
-            "ActBankPerf"  : tuple(data[18:20]),
+            "iClass"       : rec.iClass,
+            "iSubClass"    : rec.iSubClass,
+            "iRelease"     : rec.iRelease,
+            "TotalMem"     : rec.TotalMem,
+            "FreeMem"      : rec.FreeMem,
+            "FreeSampleMem": rec.FreeSampleMem,
+            "ReadyFor"     : rec.ReadyFor,
+            "ActBankPerf"  : rec.ActBankPerf,
         }
         print "  Data:"
         for k,v in sorted(datadict.iteritems()):
             print "    %s:" % k, v
-        print "  checksum:", hex(msg[offset]), \
-            "(calculated 0x%x)" % checksum(msg[1:offset])
-        if msg[offset+1] != 0xF7:
-            print "  remaining bytes:", [hex(b) for b in msg[offset+1:]]
+        self.printChecksum(msg,rec)
 
-    def printFileDumpHeader(self,msg,swapDateTime=False,prettyPrint=True):
-        offset=17
-        data = []
-        for i in xrange(2):
-            data += conv7_8(msg[offset:offset+8])
-            offset += 8
-        location = ''
-        while msg[offset] != 0:
-            location += chr(msg[offset])
-            offset += 1
-        offset+=1
-        timestr = list2str(data[2:4]) if swapDateTime else list2str(data[0:2])
-        datestr = list2str(data[0:2]) if swapDateTime else list2str(data[2:4])
+    # schemas of F_DHDR and DIR_HDR differ in the order of date and time
+    def printFileDumpHeader(self,msg,rec,prettyPrint=True):
         datadict = {
-            "filename"           : str(bytearray(msg[5:16])),
-            "flags"              : msg[16],
-            "info.Time"          : time2str(struct.unpack('>H',timestr)[0]),
-            "info.Date"          : date2str(struct.unpack('>H',datestr)[0]),
-            "info.Length"        : struct.unpack('>I',list2str(data[4:8]))[0],
-            "info.DeviceClass"   : data[8],
-            "info.DeviceSubClass": data[9],
-            "info.DeviceRelease" : data[10],
-            "info.FileType"      : data[11],
-            "info.FileFormat"    : data[12],
-            "location"           : location,
+            "filename"           : rec.filename,
+            "flags"              : rec.flags,
+            "info.Time"          : time2str(rec.time),
+            "info.Date"          : date2str(rec.date),
+            "info.Length"        : rec.length,
+            "info.DeviceClass"   : rec.DeviceClass,
+            "info.DeviceSubClass": rec.DeviceSubClass,
+            "info.DeviceRelease" : rec.DeviceRelease,
+            "info.FileType"      : rec.FileType,
+            "info.FileFormat"    : rec.FileFormat,
+            "location"           : rec.location,
         }
         if prettyPrint and not self.debug:
             if datadict["filename"] == "="*11:
@@ -128,57 +115,33 @@ class MessagePrinter(object):
             print "  Data:"
             for k,v in sorted(datadict.iteritems()):
                 print "    %s:" % k, v
-            print "  checksum:", hex(msg[offset]), \
-                "(calculated 0x%x)" % checksum(msg[1:offset])
-            if msg[offset+1] != 0xF7:
-                print "  remaining bytes:", [hex(b) for b in msg[offset+1:]]
+            self.printChecksum(msg,rec)
 
-    def printDirHeader(self,msg):
-        self.printFileDumpHeader(msg,swapDateTime=True)
-    
-    def printFileDumpDataBlock(self,msg,prettyPrint=True):
-        noctets = msg[5]
-        offset=6
-        #data = []
-        for i in xrange(noctets):
-            #data += conv7_8(msg[offset:offset+8])
-            offset += 8
+    def printFileDumpDataBlock(self,msg,rec,prettyPrint=True):
         if prettyPrint and not self.debug:
-            pass
+            if msg[rec.end+1] != 0xF7:
+                print "  remaining bytes:", [hex(b) for b in msg[rec.end+1:]]
         else:
             print "  Data:"
-            print "    noctets:", noctets
-            #print "       data:", data
-            print "  checksum:", hex(msg[offset]), \
-                "(calculated 0x%x)" % checksum(msg[1:offset])
-        if msg[offset+1] != 0xF7:
-            print "  remaining bytes:", [hex(b) for b in msg[offset+1:]]
+            print "    noctets:", rec.noctets
+            self.printChecksum(msg,rec)
 
-    def printDirectoryAnswer(self,msg):
-        offset=20
-        data = []
-        for i in xrange(2):
-            data += conv7_8(msg[offset:offset+8])
-            offset += 8
+    def printDirectoryAnswer(self,msg,rec):
         datadict = {
-            "type"          : msg[5],
-            "bank"          : msg[6],
-            "perf"          : msg[7],
-            "filename1"     : repr(str(bytearray(msg[8:19]))),
-            "fileflags"     : msg[19],
-            "datastr"       : hexdump(data),
-            "info.Time"     : struct.unpack('>H',list2str(data[0:2]))[0],
-            "info.Date"     : struct.unpack('>H',list2str(data[2:4]))[0],
-            "info.Length"   : struct.unpack('>I',list2str(data[4:8]))[0],
-            "info.InstrID"  : data[8],
-            "info.FileID"   : data[9],
-            "filename2"     : repr(str(bytearray(msg[offset:offset+11]))),
+            "type"          : rec.type,
+            "bank"          : rec.bank,
+            "perf"          : rec.perf,
+            "filename1"     : repr(rec.filename1),
+            "fileflags"     : rec.fileflags,
+            "datastr"       : hexdump(rec.data),
+            "info.Time"     : rec.time,
+            "info.Date"     : rec.date,
+            "info.Length"   : rec.length,
+            "info.InstrID"  : rec.InstrID,
+            "info.FileID"   : rec.FileID,
+            "filename2"     : repr(rec.filename2),
         }
-        offset += 11
         print "  Data:"
         for k,v in sorted(datadict.iteritems()):
             print "    %s:" % k, v
-        print "  checksum:", hex(msg[offset]), \
-            "(calculated 0x%x)" % checksum(msg[1:offset])
-        if msg[offset+1] != 0xF7:
-            print "  remaining bytes:", [hex(b) for b in msg[offset+1:]]
+        self.printChecksum(msg,rec)
@@ -1,6 +1,11 @@
 import pypm, signal, os, time
 from multiprocessing import Process, Pipe
 
+from s3turbo.MessageFilter  import MessageFilter
+from s3turbo.RingBuffer     import RingBuffer
+from s3turbo.SysExAssembler import SysExAssembler
+from s3turbo.Telemetry      import Telemetry
+
 class MidiHandler(object):
     INPUT=0
     OUTPUT=1
@@ -8,19 +13,22 @@ class MidiHandler(object):
     def __init__(self):
         super(MidiHandler,self).__init__()
         self.procs   = []
+        self.telemetry = Telemetry()
         pypm.Initialize()
         
     def __del__(self):
         self.stop()
         pypm.Terminate()
 
+    # transport is 'pipe' or 'ring' (shared memory ring buffer)
     def initialize(self, indev=-1, outdev=-1, latency=10, msgfilter=[],
-                   debug=False):
+                   debug=False, transport='pipe'):
         self.indev     = indev
         self.outdev    = outdev
         self.latency   = latency
         self.msgfilter = msgfilter
         self.debug     = debug
+        self.transport = transport
         
         self.initInput()
         self.initOutput()
@@ -29,19 +37,28 @@ class MidiHandler(object):
         if self.indev < 0:
             self.print_dev(self.INPUT)
             self.indev = int(raw_input("Type input number: "))
-        self.recv_conn, recv_conn = Pipe()
+        # control messages have their own pipe, data goes through a pipe or
+        # a ring buffer
+        self.recv_control, control = Pipe()
+        if self.transport == 'ring':
+            self.recv_conn = recv_conn = RingBuffer()
+        else:
+            self.recv_conn, recv_conn = Pipe()
         self.recv_proc = Process(
             target=MidiHandler.recv_real,
-            args=(recv_conn,self.indev,self.msgfilter,self.debug)
+            args=(control,recv_conn,self.indev,self.msgfilter,self.debug)
         )
         self.recv_proc.start()
-        self.procs.append((self.recv_proc,self.recv_conn))
+        self.procs.append((self.recv_proc,self.recv_control))
 
     def initOutput(self):
         if self.outdev < 0:
             self.print_dev(self.OUTPUT)
             self.outdev = int(raw_input("Type output number: "))
-        self.send_conn, send_conn = Pipe()
+        if self.transport == 'ring':
+            self.send_conn = send_conn = RingBuffer()
+        else:
+            self.send_conn, send_conn = Pipe()
         self.send_proc = Process(
             target=MidiHandler.send_real,
             args=(send_conn,self.outdev,self.latency,self.debug)
@@ -51,18 +68,38 @@ class MidiHandler(object):
 
     def stop(self):
         for proc, conn in self.procs:
-            if proc.is_alive():
-                conn.send((-1,[]))
-                proc.join()
+            if not proc.is_alive(): continue
+            conn.send((-1,[]))
+            if proc is self.recv_proc:
+                self.stopInput(conn)
+            proc.join()
+
+    # input process answers with its filter drop counters. Pending data is
+    # discarded, so the process does not block on a full data channel
+    def stopInput(self,control):
+        try:
+            while not control.poll(0):
+                if self.recv_conn.poll(MidiHandler.POLL_MAX):
+                    self.recv_conn.recv()
+        except EOFError:
+            pass
+        try:
+            timestamp, dropped = control.recv()
+        except EOFError:
+            return
+        MessageFilter(self.msgfilter).record(self.telemetry,dropped)
 
     def send(self, payload):
+        self.telemetry.packet('tx',len(payload[1]))
         self.send_conn.send(payload)
 
     def poll(self, timeout):
         return self.recv_conn.poll(timeout)
 
     def recv(self):
-        return self.recv_conn.recv()
+        payload = self.recv_conn.recv()
+        self.telemetry.packet('rx',len(payload[1]))
+        return payload
 
     @staticmethod
     def send_real(send_conn, outdev, latency, debug=False):
@@ -83,6 +120,8 @@ class MidiHandler(object):
             if msg[0] == 0xF0 and msg[-1] == 0xF7:
                 if debug:
                     print "Sending  SysEx:", timestamp, [ hex(b) for b in msg ]
+                # pypm converts lists only, messages may be tuples
+                if not isinstance(msg,list): msg = list(msg)
                 MidiOut.WriteSysEx( timestamp, msg)
             else:
                 print "Trying to send non-sysex message"
@@ -90,56 +129,43 @@ class MidiHandler(object):
         del MidiOut
         
     @staticmethod
-    def recv_real(recv_conn, indev, msgfilter=[], debug=False):
+    def recv_real(control, recv_conn, indev, msgfilter=[], debug=False):
         signal.signal(signal.SIGINT,signal.SIG_IGN)
         MidiIn = pypm.Input(indev)
         # does not seem to work, leave at default (FILT_ACTIVE)
         #MidiIn.SetFilter(pypm.FILT_ACTIVE | pypm.FILT_CLOCK)
-        bufsize=10
-        sysex = []
-        sysex_timestamp = None
+        msgfilter = MessageFilter(msgfilter)
+        assembler = SysExAssembler(msgfilter=msgfilter)
+        idle = 0.
         while True:
+            # waiting for control messages doubles as sleep between polls
             try:
-                if recv_conn.poll():
-                    (timestamp, msg) = recv_conn.recv()
+                if control.poll(idle):
+                    (timestamp, msg) = control.recv()
                     if timestamp < 0:
+                        control.send((-1,msgfilter.dropped))
                         break
             except EOFError:
                 break
-            
-            #while not MidiIn.Poll(): pass
-            # sleep 1ms to keep CPU usage down
-            time.sleep(1e-3)
-            MidiData = MidiIn.Read(bufsize)
-            nev = len(MidiData)
-            for msg in MidiData:
-                msgtype = msg[0][0]
-                timestamp = msg[1]
-                ignore = False
-                for f in msgfilter:
-                    for i in xrange(min(len(f),len(msg[0]))):
-                        if f[i] != msg[0][i]:
-                            break
-                    else:
-                        ignore = True
-                if ignore:
-                    continue
 
-                if msgtype == 0xF0:
-                    sysex = msg[0]
-                    sysex_timestamp = timestamp
-                elif sysex_timestamp == timestamp:
-                    sysex += msg[0]
-                    if 0xF7 in sysex:
-                        sysex = sysex[:sysex.index(0xF7)+1]
-                        if debug:
-                            print "Received SysEx:", sysex_timestamp, \
-                                [hex(b) for b in sysex ]
-                        recv_conn.send( (sysex_timestamp, sysex))
-                        sysex = []
-                        sysex_timestamp = None
-                else:
-                    recv_conn.send( (timestamp, msg[0]))
+            # back off while idle, stay responsive during transfers
+            if MidiIn.Poll() <= 0:
+                idle = min(max(2*idle,MidiHandler.POLL_MIN),
+                           MidiHandler.POLL_MAX)
+                continue
+            idle = 0.
+
+            # drain all pending events
+            nev = MidiHandler.RECV_BUFSIZE
+            while nev == MidiHandler.RECV_BUFSIZE:
+                MidiData = MidiIn.Read(MidiHandler.RECV_BUFSIZE)
+                nev = len(MidiData)
+                for data, timestamp in MidiData:
+                    for payload in assembler.feed(data,timestamp):
+                        if debug and payload[1][0] == 0xF0:
+                            print "Received SysEx:", payload[0], \
+                                [hex(b) for b in payload[1] ]
+                        recv_conn.send(payload)
         del MidiIn
                     
     def print_dev(self,InOrOut):
@@ -153,3 +179,10 @@ class MidiHandler(object):
                 if (opened == 1): print "(opened)"
                 else: print "(unopened)"
         print
+
+# events per read, pypm does not allow more than 1024
+MidiHandler.RECV_BUFSIZE = 1024
+# range of sleep between polls of an idle input in seconds. PortMidi reports
+# a SysEx only when it is complete, the wait adds to the ACK turnaround
+MidiHandler.POLL_MIN = 1e-4
+MidiHandler.POLL_MAX = 1e-3
@@ -0,0 +1,64 @@
+import mmap, struct, time, ctypes
+from multiprocessing import RawValue, Semaphore
+
+# single producer, single consumer queue of (timestamp, message) frames in
+# shared memory, offers the send/poll/recv subset of a Connection. Has to be
+# created before forking the process on the other end
+class RingBuffer(object):
+    def __init__(self,size=None):
+        self.size  = size if size else RingBuffer.SIZE
+        self.buf   = mmap.mmap(-1,self.size)
+        # total number of bytes written and read
+        self.head  = RawValue(ctypes.c_ulonglong,0)
+        self.tail  = RawValue(ctypes.c_ulonglong,0)
+        # counts complete frames, consumer side keeps acquired ones
+        self.avail   = Semaphore(0)
+        self.pending = 0
+
+    def write(self,pos,data):
+        pos %= self.size
+        n = min(len(data),self.size-pos)
+        self.buf[pos:pos+n] = data[:n]
+        if n < len(data): self.buf[:len(data)-n] = data[n:]
+
+    def read(self,pos,length):
+        pos %= self.size
+        n = min(length,self.size-pos)
+        data = self.buf[pos:pos+n]
+        if n < length: data += self.buf[:length-n]
+        return data
+
+    def send(self,payload):
+        timestamp, msg = payload
+        data = RingBuffer.header.pack(len(msg),int(timestamp)) + \
+               str(bytearray(msg))
+        if len(data) > self.size:
+            raise ValueError("RingBuffer: frame of %d bytes too large" %
+                             len(data))
+        # wait for consumer to make room
+        while self.head.value + len(data) - self.tail.value > self.size:
+            time.sleep(RingBuffer.WAIT)
+        self.write(self.head.value,data)
+        self.head.value += len(data)
+        self.avail.release()
+
+    def poll(self,timeout=0.):
+        if self.pending: return True
+        if timeout is None: ok = self.avail.acquire()
+        else:               ok = self.avail.acquire(True,timeout)
+        if ok: self.pending += 1
+        return ok
+
+    def recv(self):
+        if not self.pending: self.avail.acquire()
+        else:                self.pending -= 1
+        tail = self.tail.value
+        length, timestamp = RingBuffer.header.unpack(
+            self.read(tail,RingBuffer.header.size))
+        msg = self.read(tail+RingBuffer.header.size,length)
+        self.tail.value = tail + RingBuffer.header.size + length
+        return (timestamp, list(bytearray(msg)))
+
+RingBuffer.header = struct.Struct('<Iq')
+RingBuffer.SIZE   = 1 << 22
+RingBuffer.WAIT   = 1e-4
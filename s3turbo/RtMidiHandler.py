@@ -1,13 +1,18 @@
 import rtmidi, signal, os, time
 from multiprocessing import Pipe
 
+from s3turbo.MessageFilter  import MessageFilter
+from s3turbo.SysExAssembler import SysExAssembler
+from s3turbo.Telemetry      import Telemetry
+
 class RtMidiHandler(object):
     INPUT=0
     OUTPUT=1
     
     def __init__(self):
         super(RtMidiHandler,self).__init__()
-        self.sysex = []
+        self.msgfilter = MessageFilter()
+        self.telemetry = Telemetry()
         self.midiin = rtmidi.MidiIn()
         self.midiin.ignore_types(sysex=False, timing=True, active_sense=True)
         self.midiout = rtmidi.MidiOut()
@@ -21,14 +26,15 @@ class RtMidiHandler(object):
         self.indev     = indev
         self.outdev    = outdev
         self.latency   = latency
-        self.msgfilter = msgfilter
+        self.msgfilter = MessageFilter(msgfilter)
         self.debug     = debug
+        self.assembler = SysExAssembler(msgfilter=self.msgfilter)
         
         self.initInput()
         self.initOutput()
 
     def stop(self):
-        pass
+        self.msgfilter.record(self.telemetry)
         
     def initInput(self):
         if self.indev < 0:
@@ -65,6 +71,7 @@ class RtMidiHandler(object):
         if msg[0] == 0xF0 and msg[-1] == 0xF7:
             if self.debug:
                 print "Sending  SysEx:", timestamp, [ hex(b) for b in msg ]
+            self.telemetry.packet('tx',len(msg))
             self.midiout.send_message(msg)
         else:
             print "Trying to send non-sysex message"
@@ -73,33 +80,15 @@ class RtMidiHandler(object):
         return self.recv_conn.poll(timeout)
 
     def recv(self):
-        return self.recv_conn.recv()
+        payload = self.recv_conn.recv()
+        self.telemetry.packet('rx',len(payload[1]))
+        return payload
 
     def recv_handler(self, payload, recv_conn):
-        msg, timestamp = payload
-        msg = [ m for m in msg if m != 0xf8 ]
-        msgtype = msg[0]
-        for f in self.msgfilter:
-            for i in xrange(min(len(f),len(msg))):
-                if f[i] != msg[i]:
-                    break
-            else:
-                return
-            
-        if msgtype == 0xF0:
-            self.sysex = msg
-        elif len(self.sysex):
-            self.sysex += msg
-        else:
-            recv_conn.send( (0, msg))
-
-        if 0xF7 in self.sysex:
-            self.sysex = \
-                self.sysex[:self.sysex.index(0xF7)+1]
-            if self.debug:
-                print "Received SysEx:", [ hex(b) for b in self.sysex ]
-            recv_conn.send( (0, self.sysex))
-            self.sysex = []
+        for timestamp, msg in self.assembler.feed(payload[0]):
+            if self.debug and msg[0] == 0xF0:
+                print "Received SysEx:", [ hex(b) for b in msg ]
+            recv_conn.send( (timestamp, msg))
 
     def print_dev(self,InOrOut):
         if InOrOut == RtMidiHandler.INPUT:
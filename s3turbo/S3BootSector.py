@@ -1,40 +1,49 @@
 from __future__ import print_function
-import cStringIO, collections, sys
+import collections, sys
 from s3turbo.Util import CharHandler, ByteHandler, WordHandler, LongHandler
+from s3turbo.Util import compile_struct
 
 class S3BootSector(object):
+    __slots__ = [
+        'jumpcode', 'oemname', 'bytespersector', 'sectorspercluster',
+        'reserved1', 'nfats', 'nrootentries', 'nsectors', 'mediadescbyte',
+        'sectorsperfat', 'sectorspertrack', 'nheads', 'nhiddensectors',
+        'nsectorsext', 'reserved2', 'volumeserial', 'volumelabel', 'fsid',
+    ]
+
     def __init__(self):
         self.reset()
 
     def reset(self):
         for name,handler in S3BootSector.attributes.iteritems():
-            self.__setattr__(name,handler.default)
-        
+            setattr(self,name,handler.default)
+
     def to_raw(self):
-        data = cStringIO.StringIO()
-        for name,handler in S3BootSector.attributes.iteritems():
-            data.write(handler.write(self.__getattribute__(name)))
-        data.seek(S3BootSector.author_offset)
-        data.write(S3BootSector.author)
-        return data.getvalue()
-    
+        data = bytearray(S3BootSector.author_offset+len(S3BootSector.author))
+        S3BootSector.struct.pack_into(
+            data,0,*[ getattr(self,name) for name in S3BootSector.__slots__ ])
+        data[S3BootSector.author_offset:] = S3BootSector.author
+        return str(data)
+
     def from_raw(self,rawdata,ignore_defaults=['oemname'],warn_defaults=[]):
-        for name,handler in S3BootSector.attributes.iteritems():
-            data = handler.read(rawdata)
-            if self.__getattribute__(name) != data and \
-               not name in ignore_defaults:
+        if hasattr(rawdata,'read'):
+            rawdata = rawdata.read(S3BootSector.struct.size)
+        values = S3BootSector.struct.unpack_from(rawdata)
+        for (name,handler),data in zip(S3BootSector.attributes.iteritems(),
+                                       values):
+            if getattr(self,name) != data and not name in ignore_defaults:
                 s = "%s should be %s, is %s" % \
-                    (name,repr(self.__getattribute__(name)), repr(data))
+                    (name,repr(getattr(self,name)), repr(data))
                 if name in warn_defaults:
                     print("WARNING: %s, reverting to default" % s)
                     data = handler.default
                 else:
                     raise Exception(s)
-            self.__setattr__(name,data)
+            setattr(self,name,data)
 
     def dump(self,file=sys.stdout):
         for name in S3BootSector.attributes.iterkeys():
-            print("%-20s: %s" % (name,repr(self.__getattribute__(name))),
+            print("%-20s: %s" % (name,repr(getattr(self,name))),
                   file=file)
         print(file=file)
         print('fat_offset   : %10s' % hex(self.fat_offset()),  file=file)
@@ -83,6 +92,8 @@ S3BootSector.attributes = collections.OrderedDict([
     ('fsid',              CharHandler(b'\x00'*8)),
 ])
 
+S3BootSector.struct = compile_struct(S3BootSector.attributes)
+
 S3BootSector.author_offset = 0x40
 S3BootSector.author = "\x2a\x2a\x47\x45\x4e\x45\x52\x41" \
                       "\x4c\x4d\x55\x53\x49\x43\x2a\x2a" \
@@ -0,0 +1,125 @@
+from __future__ import print_function
+import os, sqlite3, hashlib
+
+from s3turbo.S3Image import S3Image
+from s3turbo.Util    import decode_path
+
+class S3Catalog(object):
+    def __init__(self,filename,debug=False):
+        self.debug = debug
+        self.db    = sqlite3.connect(filename)
+        self.db.executescript(S3Catalog.schema)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    # (re)indexes image if it is new or its mtime or size changed,
+    # returns True if the catalog was updated
+    def update(self,filename,compatibilityMode=False):
+        filename = os.path.abspath(filename)
+        st  = os.stat(filename)
+        row = self.db.execute(
+            "SELECT id, mtime, size FROM images WHERE path = ?",
+            (filename,)).fetchone()
+        if row and row[1] == st.st_mtime and row[2] == st.st_size:
+            if self.debug: print("Skipping unchanged '%s'" % filename)
+            return False
+
+        img = S3Image(debug=self.debug)
+        img.read_from_file(filename,compatibilityMode=compatibilityMode,
+                           lazy=True)
+        try:
+            volname = decode_path(img.get_volname())
+            entries = list(self.walk(img))
+        finally:
+            img.close()
+
+        with self.db:
+            if row:
+                self.db.execute("DELETE FROM files WHERE image = ?",(row[0],))
+                self.db.execute("DELETE FROM images WHERE id = ?",(row[0],))
+            image = self.db.execute(
+                "INSERT INTO images (path, mtime, size, volname)"
+                " VALUES (?, ?, ?, ?)",
+                (filename,st.st_mtime,st.st_size,volname)).lastrowid
+            self.db.executemany(
+                "INSERT INTO files (image, path, name, size, attr, mdate,"
+                " mtime, start, md5) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [ (image,path,de.decoded_name(),de.size,de.attr,de.mdate,
+                   de.mtime,de.start,md5) for path,de,md5 in entries ])
+        return True
+
+    # removes images which do not exist anymore, returns their number
+    def prune(self):
+        rows = self.db.execute("SELECT id, path FROM images").fetchall()
+        gone = [ (i,) for i,path in rows if not os.path.exists(path) ]
+        with self.db:
+            self.db.executemany("DELETE FROM files WHERE image = ?",gone)
+            self.db.executemany("DELETE FROM images WHERE id = ?",gone)
+        return len(gone)
+
+    # yields (path, entry, md5) for all entries below directory start
+    def walk(self,img,start=0,path='A:'):
+        dirs, files = img.read_dir(start,no_dotdirs=True)
+        for f in files:
+            md5 = hashlib.md5()
+            for chunk in img.iter_file(f,compatibilityMode=True):
+                md5.update(chunk)
+            yield (path+'\\'+f.decoded_name(), f, md5.hexdigest())
+        for d in dirs:
+            dirpath = path+'\\'+d.decoded_name()
+            yield (dirpath, d, None)
+            for entry in self.walk(img,d.start,dirpath):
+                yield entry
+
+    # all arguments are optional filters, name and path are glob patterns,
+    # dates are S3 date integers
+    def search(self,name=None,path=None,minsize=None,maxsize=None,
+               after=None,before=None,md5=None):
+        where, params = [], []
+        for clause, value in [
+                ("files.name GLOB ?", name),
+                ("files.path GLOB ?", path),
+                ("files.size >= ?",   minsize),
+                ("files.size <= ?",   maxsize),
+                ("files.mdate >= ?",  after),
+                ("files.mdate <= ?",  before),
+                ("files.md5 = ?",     md5),
+        ]:
+            if value is None: continue
+            where.append(clause)
+            params.append(value)
+        query = "SELECT images.path, files.path, files.size, files.attr," \
+                " files.mdate, files.mtime, files.md5" \
+                " FROM files JOIN images ON files.image = images.id"
+        if len(where):
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY images.path, files.path"
+        return self.db.execute(query,params).fetchall()
+
+S3Catalog.schema = """
+CREATE TABLE IF NOT EXISTS images (
+    id      INTEGER PRIMARY KEY,
+    path    TEXT UNIQUE,
+    mtime   REAL,
+    size    INTEGER,
+    volname TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    image   INTEGER REFERENCES images(id),
+    path    TEXT,
+    name    TEXT,
+    size    INTEGER,
+    attr    INTEGER,
+    mdate   INTEGER,
+    mtime   INTEGER,
+    start   INTEGER,
+    md5     TEXT
+);
+CREATE INDEX IF NOT EXISTS files_image ON files(image);
+CREATE INDEX IF NOT EXISTS files_name  ON files(name);
+CREATE INDEX IF NOT EXISTS files_size  ON files(size);
+CREATE INDEX IF NOT EXISTS files_mdate ON files(mdate);
+CREATE INDEX IF NOT EXISTS files_md5   ON files(md5);
+"""
@@ -0,0 +1,286 @@
+from __future__ import print_function
+import collections, fnmatch, struct, time
+
+from s3turbo.MSCEIMessage import MSCEIMessage
+from s3turbo.S3Image      import S3Image
+from s3turbo.S3Turbo      import S3FunctionName
+from s3turbo.SampleDumpHandler import HandshakeMessage
+from s3turbo.Telemetry    import Telemetry
+from s3turbo.Util         import conv8_7_all, list2str, str2list
+
+# device side of the MSCEI protocol, serving files from an S3Image; has the
+# same interface as RtMidiHandler so it can replace the MIDI connection
+class S3Emulator(object):
+    INPUT=0
+    OUTPUT=1
+
+    def __init__(self, image, delay=0., byterate=None, samples=None,
+                 compatibilityMode=False):
+        super(S3Emulator,self).__init__()
+        if isinstance(image,S3Image):
+            self.img = image
+        else:
+            self.img = S3Image()
+            self.img.read_from_file(image,compatibilityMode=compatibilityMode)
+        self.delay     = delay
+        self.byterate  = byterate
+        self.samples   = samples if samples else []
+        self.debug     = False
+        self.msgfilter = []
+        self.received  = []
+        self.telemetry = Telemetry()
+        self.reset()
+
+    def reset(self):
+        self.queue     = collections.deque()
+        self.starttime = time.time()
+        self.lastdue   = self.starttime
+        self.job       = None
+        self.current   = None
+        self.sds       = None
+        self.sds_in    = None
+
+    def initialize(self, indev=-1, outdev=-1, latency=10, msgfilter=[],
+                   debug=False):
+        self.latency   = latency
+        self.msgfilter = msgfilter
+        self.debug     = debug
+        self.reset()
+
+    def stop(self):
+        self.job = None
+        self.sds = None
+
+    # host interface
+    def send(self, payload):
+        timestamp, msg = payload
+        if not msg or len(msg) < 2:
+            print("Malformed message", timestamp, [ hex(b) for b in msg ])
+            return
+        if msg[0] == 0xF0 and msg[-1] == 0xF7:
+            if self.debug:
+                print("Sending  SysEx:", timestamp, [ hex(b) for b in msg ])
+            self.telemetry.packet('tx',len(msg))
+            self.handle(list(msg))
+        else:
+            print("Trying to send non-sysex message")
+
+    def poll(self, timeout):
+        now = time.time()
+        if not len(self.queue):
+            time.sleep(timeout)
+            return False
+        wait = self.queue[0][0]-now
+        if wait > timeout:
+            time.sleep(timeout)
+            return False
+        if wait > 0: time.sleep(wait)
+        return True
+
+    def recv(self):
+        due, msg = self.queue.popleft()
+        self.telemetry.packet('rx',len(msg))
+        if self.debug:
+            print("Received SysEx:", [ hex(b) for b in msg ])
+        return (int((due-self.starttime)*1000), msg)
+
+    def print_dev(self,InOrOut):
+        print(0, "S3 Turbo emulator (%s)" %
+              self.img.get_volname().strip())
+        print()
+
+    # device side
+    def reply(self,msg):
+        if isinstance(msg,MSCEIMessage): msg = msg.raw()
+        due = max(time.time(),self.lastdue) + self.delay
+        if self.byterate: due += float(len(msg))/self.byterate
+        self.lastdue = due
+        self.queue.append((due,msg))
+
+    # sends first message of job, the rest is sent one per ACK
+    def start(self,job):
+        self.job = job
+        self.advance()
+
+    def advance(self):
+        if self.job is None: return
+        try:
+            self.current = next(self.job)
+        except StopIteration:
+            self.job = self.current = None
+            return
+        self.reply(self.current)
+
+    def handle(self,msg):
+        if msg[1] == 0x7E:
+            return self.handleSampleDump(msg)
+        fname = S3FunctionName(msg)
+        if fname in [ "F_WAIT", "D_WAIT" ]: return
+        elif fname in [ "F_ACK", "D_ACK" ]:
+            self.advance()
+        elif fname in [ "F_NACK", "D_NACK" ]:
+            if self.current: self.reply(self.current)
+        elif fname in [ "F_CANCEL", "D_CANCEL" ]:
+            self.job = self.current = None
+        else:
+            handler = S3Emulator.handlers.get(fname)
+            if handler: handler(self,msg)
+            elif self.debug: print("Emulator: ignoring", fname)
+
+    def error(self,fname,errno):
+        self.job = self.current = None
+        self.reply(MSCEIMessage(errno,fromName=fname))
+
+    # resolves host path like 'A:\SETUP\SAMPLES\' to a directory cluster
+    def find_dir(self,path):
+        segments = [ s for s in path.split('\\') if len(s) ]
+        if len(segments) and segments[0].endswith(':'):
+            segments = segments[1:]
+        if not len(segments): return 0
+        de = self.img.lookup(segments)
+        if de is None or not de.is_dir(): return None
+        return de.start
+
+    def entries(self,cluster,pattern='*'):
+        dirs, files = self.img.read_dir(cluster,no_dotdirs=True)
+        pattern = pattern.rstrip()
+        return [ de for de in dirs + files
+                 if fnmatch.fnmatchcase(de.name().rstrip(),pattern) ]
+
+    def handleStatusRequest(self,msg):
+        free  = self.img.fat.nempty_clusters()*self.img.bs.cluster_size()
+        total = self.img.bs.disk_size()
+        data  = struct.pack('>BBBxIIIBBBBx',1,2,2,total,free,free,
+                            0xff,0xff,0x30,0x30)
+        self.reply(MSCEIMessage(*conv8_7_all(data),fromName="STAT_ANSWER"))
+
+    def handleFileDirRequest(self,msg):
+        pattern = list2str(msg[5:16])
+        path    = list2str(msg[16:msg.index(0,16)])
+        cluster = self.find_dir(path)
+        if cluster is None: return self.error("F_ERR",S3Emulator.ERR_NOTFOUND)
+        def job():
+            yield self.fileHeader("DIR_HDR",'='*11,0,0,0,'',path,dir=True)
+            for de in self.entries(cluster,pattern):
+                yield self.fileHeader("DIR_HDR",de.name(),de.mdate,de.mtime,
+                                      de.size,self.prefix(de),path,
+                                      dir=de.is_dir())
+        self.start(job())
+
+    def handleFileDumpRequest(self,msg):
+        filename = list2str(msg[5:16])
+        path     = list2str(msg[16:msg.index(0,16)])
+        cluster  = self.find_dir(path)
+        files    = [] if cluster is None else \
+                   [ de for de in self.entries(cluster,filename)
+                     if not de.is_dir() ]
+        if not len(files): return self.error("F_ERR",S3Emulator.ERR_NOTFOUND)
+        de   = files[0]
+        data = self.img.extract_file(de)
+        def job():
+            yield self.fileHeader("F_DHDR",de.name(),de.mdate,de.mtime,
+                                  de.size,data[:6],path)
+            for m in self.packets("F_DPKT",data[6:]): yield m
+        self.start(job())
+
+    def handleDataRequest(self,msg):
+        dtype, filename = msg[5], list2str(msg[8:19])
+        dirname = S3Emulator.data_dirs.get(dtype)
+        cluster = None if dirname is None else self.find_dir(dirname[0])
+        if cluster is None: return self.error("D_ERR",S3Emulator.ERR_NOTFOUND)
+        if dirname[1]: filename = dirname[1]
+        files = [ de for de in self.entries(cluster,filename)
+                  if not de.is_dir() ]
+        if not len(files): return self.error("D_ERR",S3Emulator.ERR_NOTFOUND)
+        de   = files[0]
+        data = self.img.extract_file(de)
+        def job():
+            info = struct.pack('>HHIBB4x',de.mtime,de.mdate,de.size,0,0)
+            yield MSCEIMessage(*(msg[5:8] + str2list(de.name()) + [0] +
+                                 list(conv8_7_all(info)) +
+                                 str2list(de.name())),
+                               fromName="DATA_HEADER")
+            for m in self.packets("DATA_DUMP",data): yield m
+        self.start(job())
+
+    # first bytes of file, sent with its header
+    def prefix(self,de):
+        if de.is_dir(): return '\x01\x02\x02\x20\x20\x00'
+        for chunk in self.img.iter_file(de):
+            return str(chunk[:6])
+        return ''
+
+    def fileHeader(self,fname,name,mdate,mtime,size,prefix,path,dir=False):
+        if fname == "DIR_HDR": info = struct.pack('>HHI',mdate,mtime,size)
+        else:                  info = struct.pack('>HHI',mtime,mdate,size)
+        info += prefix.ljust(6,'\x00')
+        return MSCEIMessage(*(str2list(name.ljust(11)) +
+                              [ 0x10 if dir else 0 ] +
+                              list(conv8_7_all(info)) +
+                              str2list(path) + [ 0 ]),
+                            fromName=fname)
+
+    def packets(self,fname,data):
+        n = 7*S3Emulator.PACKET_GROUPS
+        for pos in xrange(0,len(data),n):
+            chunk = data[pos:pos+n]
+            yield MSCEIMessage(*([ (len(chunk)+6)/7 ] +
+                                 list(conv8_7_all(chunk))),
+                               fromName=fname)
+
+    # MIDI sample dump standard
+    def handleSampleDump(self,msg):
+        if msg[3] == 0x3:
+            number = msg[5] << 7 | msg[4]
+            if number >= len(self.samples):
+                self.reply(HandshakeMessage.Cancel(packetnumber=0))
+                return
+            with open(self.samples[number],'rb') as f:
+                raw = str2list(f.read())
+            self.sds = []
+            start = 0
+            while 0xF7 in raw[start:]:
+                end = raw.index(0xF7,start)+1
+                self.sds.append(raw[start:end])
+                start = end
+            self.sds.reverse()
+            if len(self.sds): self.reply(self.sds[-1])
+        elif msg[3] == 0x7F and self.sds:
+            self.sds.pop()
+            if len(self.sds): self.reply(self.sds[-1])
+            else:             self.sds = None
+        elif msg[3] == 0x7E and self.sds:
+            self.reply(self.sds[-1])
+        elif msg[3] == 0x7D:
+            self.sds = None
+        elif msg[3] in [ 0x1, 0x2 ]:
+            if msg[3] == 0x1: self.sds_in = []
+            if not self.sds_in is None: self.sds_in.append(msg)
+            self.reply(HandshakeMessage.ACK(packetnumber=msg[4]))
+        elif msg[3] == 0x7B and not self.sds_in is None:
+            self.received.append(self.sds_in)
+            self.sds_in = None
+
+    # asks host for a sample, received dumps are appended to self.received
+    def requestSample(self,number):
+        self.reply([ 0xF0, 0x7E, 0x0, 0x3, number & 0x7F, number >> 7, 0xF7 ])
+
+S3Emulator.handlers = {
+    "STAT_REQUEST": S3Emulator.handleStatusRequest,
+    "DIR_DRQ":      S3Emulator.handleFileDirRequest,
+    "F_DREQ":       S3Emulator.handleFileDumpRequest,
+    "DATA_REQUEST": S3Emulator.handleDataRequest,
+}
+
+# DATA_REQUEST types, directory and fixed file name
+S3Emulator.data_dirs = {
+    0x0: ('A:\\SETUP\\SOUNDS',  None),
+    0x1: ('A:\\SETUP\\SAMPLES', None),
+    0x2: ('A:\\SETUP',          'SOUNDMAP'),
+    0x3: ('A:\\SETUP',          'EFFECT1'),
+    0x4: ('A:\\SETUP',          'EFFECT2'),
+    0x5: ('A:\\SETUP',          'GENERAL'),
+}
+
+S3Emulator.PACKET_GROUPS = 32
+S3Emulator.ERR_NOTFOUND  = 12
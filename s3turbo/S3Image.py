@@ -1,30 +1,77 @@
 from __future__ import print_function
-import cStringIO, os, time, struct
+import cStringIO, os, time, struct, mmap
 
 from s3turbo.Util import date2str, time2str, str2date, str2time
 from s3turbo.Util import encode_path, time_conv_to_local, time_conv_from_local
+from s3turbo.Util import LRUCache, to_str
 from s3turbo.S3Turbo      import S3Exception
 from s3turbo.S3BootSector import S3BootSector
 from s3turbo.Fat12        import Fat12
 from s3turbo.DirEntry     import DirEntry
 
 class S3Image(object):
-    def __init__(self,debug=False):
-        self.debug = debug
+    def __init__(self,debug=False,contiguous=False):
+        self.debug      = debug
+        self.contiguous = contiguous
         self.reset()
 
     def reset(self):
+        if hasattr(self,'image'): self.close()
         self.bs          = S3BootSector()
         self.fat         = Fat12(rawsize=self.bs.fat_size())
+        self.set_fat_geometry()
         self.clusterdata = {}
+        # contiguous buffer of a new image is built on first use
+        self.image       = None
+        self.readonly    = False
+        self.dircache    = LRUCache(S3Image.DIRCACHE_SIZE)
+        self.dirindex    = {}
+
+    def set_fat_geometry(self):
+        spc = self.bs.sectorspercluster
+        self.fat.set_geometry(
+            self.ndata_clusters(),
+            self.bs.sectorspertrack*self.bs.nheads/spc,
+            self.cluster_to_offset(2)/self.bs.bytespersector/spc)
+
+    def init_image(self):
+        if self.contiguous and self.image is None:
+            self.image = self.new_image()
+
+    def new_image(self):
+        image = bytearray(self.bs.disk_size())
+        start = self.cluster_to_offset(2)
+        end   = self.cluster_to_offset(self.ndata_clusters()+2)
+        image[start:end] = '\xcb'*(end-start)
+        start = self.bs.root_offset()
+        image[start:start+DirEntry.SIZE] = self.default_volentry()
+        return image
+
+    def default_volentry(self):
+        return DirEntry(shortname='\x20'*8, shortext='\x20'*3,
+                        attr=DirEntry.ATTR_VOLLABEL).to_raw()
+
+    def close(self):
+        if isinstance(self.image,mmap.mmap):
+            self.image.close()
+        self.image = None
+
+    def check_writable(self,fname):
+        if self.readonly:
+            raise S3Exception("%s: image is opened read-only" % fname)
 
     def get_clusterdata(self,index,throw=False):
+        if self.contiguous and index != 1:
+            return self.cluster_view(index,readonly=True)
         if index == 0:
-            return self.clusterdata.get(
-                0, DirEntry(shortname='\x20'*8, shortext='\x20'*3,
-                            attr=DirEntry.ATTR_VOLLABEL).to_raw())
+            return self.clusterdata.get(0,self.default_volentry())
         elif index == 1:
             raise S3Exception("illegal cluster index")
+        elif not self.image is None and not index in self.clusterdata and \
+             self.fat.get(index) != 0:
+            # serve allocated clusters directly from the mapped image
+            return buffer(self.image,self.cluster_to_offset(index),
+                          self.bs.cluster_size())
         else:
             if not throw:
                 return self.clusterdata.get(
@@ -32,6 +79,33 @@ class S3Image(object):
 
         return self.clusterdata[index]
 
+    # read-only views are buffers, which can be written to any file object
+    def cluster_view(self,index,readonly=False):
+        self.init_image()
+        if index == 0:
+            offset, size = self.bs.root_offset(), self.bs.root_size()
+        else:
+            offset, size = self.cluster_to_offset(index), self.bs.cluster_size()
+        if isinstance(self.image,bytearray) and not readonly:
+            return memoryview(self.image)[offset:offset+size]
+        return buffer(self.image,offset,size)
+
+    def set_clusterdata(self,index,data):
+        if self.contiguous:
+            view = self.cluster_view(index)
+            view[:len(data)] = data
+            view[len(data):] = '\0'*(len(view)-len(data))
+        else:
+            self.clusterdata[index] = to_str(data)
+
+    def put_clusterdata(self,index,pos,data):
+        if self.contiguous:
+            self.cluster_view(index)[pos:pos+len(data)] = data
+        else:
+            cd = to_str(self.get_clusterdata(index))
+            self.clusterdata[index] = \
+                cd[:pos].ljust(pos,'\0') + to_str(data) + cd[pos+len(data):]
+
     def ndata_clusters(self):
         skip_sectors = 1 + \
                        self.bs.sectorsperfat*self.bs.nfats + \
@@ -43,14 +117,16 @@ class S3Image(object):
             self.bs.nrootentries*DirEntry.SIZE + \
             self.bs.cluster_size()*(cluster-2)
 
-    def read_from_file(self,filename,compatibilityMode=False):
+    def read_from_file(self,filename,compatibilityMode=False,lazy=False):
         if not os.path.exists(filename):
             raise S3Exception("File '%s' not found" % filename)
         with open(filename,'rb') as f:
+            if lazy:
+                f = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
             self.read(f,compatibilityMode=compatibilityMode,
-                      maxsize=os.path.getsize(filename))
+                      maxsize=os.path.getsize(filename),lazy=lazy)
         
-    def read(self,f,compatibilityMode=False,maxsize=-1):
+    def read(self,f,compatibilityMode=False,maxsize=-1,lazy=False):
         self.reset()
 
         if compatibilityMode:
@@ -72,9 +148,17 @@ class S3Image(object):
             else:
                 raise S3Exception(s)
 
+        # load whole disk with a single read
+        if self.contiguous and not lazy:
+            self.image = bytearray(self.bs.disk_size())
+            f.seek(0)
+            f.readinto(self.image)
+            f = cStringIO.StringIO(self.image)
+
         # read FAT
         f.seek(self.bs.fat_offset())
         self.fat.from_raw(f.read(self.bs.fat_size()))
+        self.set_fat_geometry()
 
         # read root directory
         f.seek(self.bs.root_offset())
@@ -90,7 +174,13 @@ class S3Image(object):
         if not vl.has_attr(DirEntry.ATTR_VOLLABEL):
             raise S3Exception(
                 "volume information is not first entry in root directory")
-        self.clusterdata[0] = rootdir
+        if not self.contiguous: self.clusterdata[0] = rootdir
+
+        # keep mapping, data clusters are served by get_clusterdata()
+        if lazy:
+            self.image    = f
+            self.readonly = True
+        if lazy or self.contiguous: return
         
         # read rest of disk
         for cluster in range(2,self.ndata_clusters()+2):
@@ -102,47 +192,78 @@ class S3Image(object):
         with open(filename,'wb') as f:
             self.write(f)
 
-    def write(self,f):
-        f.write(self.bs.to_raw())
-        f.seek(self.bs.fat_offset())
-        f.write(self.fat.to_raw())
-        f.seek(self.bs.root_offset())
-        f.write(self.get_clusterdata(0))
+    def sync_image(self):
+        # boot sector and FAT are kept as objects, copy them to the buffer
+        self.init_image()
+        if not isinstance(self.image,bytearray): return
+        bs = self.bs.to_raw()
+        self.image[:len(bs)] = bs
+        start = self.bs.fat_offset()
+        self.image[start:start+self.bs.fat_size()] = self.fat.to_raw()
+
+    # yields (name, offset, size, data) for the disk regions in write order,
+    # data may be shorter than size and is padded with zeros on disk
+    def regions(self):
+        bs = self.bs
+        if self.contiguous:
+            self.sync_image()
+            yield ('boot sector', 0, bs.bytespersector,
+                   buffer(self.image,0,bs.bytespersector))
+            yield ('FAT', bs.fat_offset(), bs.fat_size(),
+                   buffer(self.image,bs.fat_offset(),bs.fat_size()))
+        else:
+            yield ('boot sector', 0, bs.bytespersector, bs.to_raw())
+            yield ('FAT', bs.fat_offset(), bs.fat_size(), self.fat.to_raw())
+        yield ('root directory', bs.root_offset(), bs.root_size(),
+               self.get_clusterdata(0))
         for cluster in range(2,self.ndata_clusters()+2):
-            f.seek(self.cluster_to_offset(cluster))
-            f.write(self.get_clusterdata(cluster))
+            yield ('cluster 0x%x' % cluster, self.cluster_to_offset(cluster),
+                   bs.cluster_size(), self.get_clusterdata(cluster))
+
+    def write(self,f):
+        self.init_image()
+        if isinstance(self.image,bytearray):
+            self.sync_image()
+            f.write(self.image)
+            return
+        for name, offset, size, data in self.regions():
+            f.seek(offset)
+            f.write(data)
         
     def test_file(self,filename):
         if not os.path.exists(filename):
             raise S3Exception("File '%s' not found" % filename)
+
+        import hashlib
+        hash_test, hash_write = hashlib.md5(), hashlib.md5()
+        mismatches = 0
         with open(filename,'rb') as f:
-            testdata = f.read()
-
-        import hashlib, binascii
-        hash_test = hashlib.md5()
-        hash_test.update(testdata)
-        digest_test = binascii.hexlify(hash_test.digest())
-        write = cStringIO.StringIO()
-        self.write(write)
-        hash_write = hashlib.md5()
-        hash_write.update(write.getvalue())
-        digest_write = binascii.hexlify(hash_write.digest())
+            # compare region by region against what write() would produce
+            for name, offset, size, data in self.regions():
+                f.seek(offset)
+                orig = f.read(size)
+                n    = len(data)
+                if self.debug:
+                    hash_test.update(orig)
+                    hash_write.update(data)
+                    hash_write.update('\0'*(size-n))
+                if len(orig) != size or memoryview(orig)[:n] != data or \
+                   orig.count('\0',n) != size-n:
+                    print("Mismatch in %s at address 0x%x" % (name,offset))
+                    mismatches += 1
+            f.seek(0,os.SEEK_END)
+            if f.tell() != self.bs.disk_size():
+                print("Mismatch in file size, %d bytes instead of %d" % \
+                      (f.tell(),self.bs.disk_size()))
+                mismatches += 1
 
         if self.debug:
-            print("md5  in: %s" % digest_test)
-            print("md5 out: %s" % digest_write)
-
-        if digest_test != digest_write:
-            with open(filename,'rb') as f:
-                for cluster in range(2,self.ndata_clusters()+2):
-                    f.seek(self.cluster_to_offset(cluster))
-                    orig = f.read(self.bs.cluster_size())
-                    proc = self.get_clusterdata(cluster)
-                    if orig != proc:
-                        print("First mismatch in cluster 0x%x at address 0x%x"%\
-                              (cluster,self.cluster_to_offset(cluster)))
-                        break
-            raise S3Exception("test_file failed")
+            print("md5  in: %s" % hash_test.hexdigest())
+            print("md5 out: %s" % hash_write.hexdigest())
+
+        if mismatches:
+            raise S3Exception("test_file failed, %d mismatching regions" % \
+                              mismatches)
         
     def get_volattr(self,attr):
         cd = self.get_clusterdata(0)
@@ -164,13 +285,14 @@ class S3Image(object):
         return self.get_volattr('mtime')
         
     def set_volattr(self,attr,value):
+        self.check_writable('set_volattr')
         cd = self.get_clusterdata(0)
         vl = DirEntry(data=cd[:DirEntry.SIZE])
         if attr == 'name':
             vl.set_name(value)
         else:
             vl.__setattr__(attr,value)
-        self.clusterdata[0] = vl.to_raw() + cd[DirEntry.SIZE:]
+        self.put_clusterdata(0,0,vl.to_raw())
 
     def set_volname(self,name):
         if len(name) > 11:
@@ -187,6 +309,7 @@ class S3Image(object):
         self.set_volattr('mtime',t)
 
     def set_oemname(self,oemname):
+        self.check_writable('set_oemname')
         self.bs.oemname = oemname
         
     def dump_direntry(self,de,indent=0):
@@ -249,33 +372,28 @@ class S3Image(object):
         if not (path.startswith("A:\\") or path.startswith("\\")):
             raise S3Exception("mkdir: need absolute path")
         start   = self.check_dirs(path,**kwargs)
-        dirs, _ = self.read_dir(start,no_dotdirs=True)
         dirname = path.split('\\')[-1]
-        for de in dirs:
-            if de.decoded_name() == dirname:
-                if kwargs.get('errOnExist',False):
-                    raise S3Exception("directory already exists")
-                else: return
+        de = self.dir_index(start).get(dirname)
+        if de and de.is_dir():
+            if kwargs.get('errOnExist',False):
+                raise S3Exception("directory already exists")
+            else: return
         self.mkdir_real(dirname,start,**kwargs)
 
     def check_dirs(self,path,**kwargs):
-        segments = path.split('\\')[1:]
-        start    = 0
-        while len(segments) > 1:
-            dirs, _ = self.read_dir(start,no_dotdirs=True)
-            for de in dirs:
-                if de.decoded_name() == segments[0]:
-                    segments = segments[1:]
-                    start    = de.start
-                    break
+        start = 0
+        for segment in path.split('\\')[1:-1]:
+            de = self.dir_index(start).get(segment)
+            if de and de.is_dir():
+                start = de.start
+            elif kwargs.get('recursive',True):
+                start = self.mkdir_real(segment,start,**kwargs)
             else:
-                if kwargs.get('recursive',True):
-                    self.mkdir_real(segments[0],start,**kwargs)
-                else:
-                    raise S3Exception("subdir %s not found" % segments[0])
+                raise S3Exception("subdir %s not found" % segment)
         return start
 
     def mkdir_real(self,name,cluster,**kwargs):
+        self.check_writable('mkdir')
         # actually make directory
         newstart = self.fat.create_chain(1)[0]
         kwargs['attr']  = DirEntry.ATTR_DIR | kwargs.get('attr',0)
@@ -285,27 +403,30 @@ class S3Image(object):
         de = DirEntry(**kwargs)
         de.encode_name(name)
         self.add_direntry(cluster,de)
-        de.set_name('.')
-        self.clusterdata[newstart] = de.to_raw()
-        de.set_name('..')
-        de.start = cluster
-        self.clusterdata[newstart] += de.to_raw()
+        dot = DirEntry(**kwargs)
+        dot.set_name('.')
+        kwargs['start'] = cluster
+        dotdot = DirEntry(**kwargs)
+        dotdot.set_name('..')
+        self.set_clusterdata(newstart,dot.to_raw()+dotdot.to_raw())
+        self.dircache.pop(newstart)
+        self.dirindex[newstart] = {}
+        return newstart
 
     def copy(self,path,data,**kwargs):
         if not (path.startswith("A:\\") or path.startswith("\\")):
             raise S3Exception("copy: need absolute path")
-        start   = self.check_dirs(path,**kwargs)
-        dirs, _ = self.read_dir(start,no_dotdirs=True)
+        start    = self.check_dirs(path,**kwargs)
         filename = path.split('\\')[-1]
-        for de in dirs:
-            if de.decoded_name() == filename:
-                if kwargs.get('errOnExist',True):
-                    raise S3Exception("file already exists")
-                else: return
+        if filename in self.dir_index(start):
+            if kwargs.get('errOnExist',True):
+                raise S3Exception("file already exists")
+            else: return
         self.copy_real(filename,start,data,**kwargs)
 
     def copy_real(self,name,cluster,data,**kwargs):
-        nclusters = int(len(data)/self.bs.cluster_size()+1)
+        self.check_writable('copy')
+        nclusters = self.nclusters_for(len(data))
         # actually make file
         chain = self.fat.create_chain(nclusters)
         kwargs['start'] = chain[0]
@@ -315,55 +436,102 @@ class S3Image(object):
         de = DirEntry(**kwargs)
         de.encode_name(name)
         self.add_direntry(cluster,de)
+        self.write_chain(chain,data)
+
+    def write_chain(self,chain,data):
+        # slice through a view to avoid copying the data per cluster
+        data = memoryview(data)
         for i,c in enumerate(chain):
-            self.clusterdata[c] = data[i*self.bs.cluster_size():
-                                       (i+1)*self.bs.cluster_size()]
-        
+            self.set_clusterdata(c,data[i*self.bs.cluster_size():
+                                        (i+1)*self.bs.cluster_size()])
+
+    def nclusters_for(self,size):
+        return int(size/self.bs.cluster_size()+1)
+
+    def free_slots(self,cluster):
+        if cluster == 0:
+            dirchain, size = [ 0 ], self.bs.root_size()
+        else:
+            dirchain, size = self.fat.get_chain(cluster), self.bs.cluster_size()
+        n = 0
+        for c in dirchain:
+            data = self.get_clusterdata(c)
+            for pos in xrange(0,size,DirEntry.SIZE):
+                if pos >= len(data) or data[pos] == '\0': n += 1
+        return n
+
     def add_direntry(self,cluster,entry):
+        self.check_writable('add_direntry')
         if cluster == 0:
-            # add new directory to root
-            if len(self.get_clusterdata(0))==self.bs.nrootentries*DirEntry.SIZE:
-                raise S3Exception("maximum number of root entries reached")
-            self.clusterdata[0] = self.get_clusterdata(0) + entry.to_raw()
+            dirchain, size = [ 0 ], self.bs.root_size()
         else:
-            # add new directory to 'normal' directory
-            dirchain = self.fat.get_chain(cluster)
-            for cluster in dirchain:
-                data = self.get_clusterdata(cluster)
-                pos = 0
-                while pos < self.bs.cluster_size():
-                    if not pos < len(data):
-                        break
-                    if data[pos] != '\0':
-                        pos += DirEntry.SIZE
-                        continue
-                else: continue
-                self.clusterdata[cluster] = data + entry.to_raw()
-                break
-            else:
-                cluster = self.fat.extend_chain(cluster)[0]
-                self.clusterdata[cluster] = entry.to_raw()
+            dirchain, size = self.fat.get_chain(cluster), self.bs.cluster_size()
+        self.add_direntry_real(dirchain,size,entry)
+        # keep cached directory contents up to date
+        self.dircache.pop(cluster)
+        if cluster in self.dirindex:
+            self.dirindex[cluster].setdefault(entry.decoded_name(),entry)
+
+    def add_direntry_real(self,dirchain,size,entry):
+        # use first empty slot, clusters may be stored truncated
+        for c in dirchain:
+            data = self.get_clusterdata(c)
+            for pos in xrange(0,size,DirEntry.SIZE):
+                if pos >= len(data) or data[pos] == '\0':
+                    self.put_clusterdata(c,pos,entry.to_raw())
+                    return
+        if dirchain[0] == 0:
+            raise S3Exception("maximum number of root entries reached")
+        self.set_clusterdata(self.fat.extend_chain(dirchain[0])[0],
+                             entry.to_raw())
+
+    # maps decoded names to entries of directory at cluster, built once
+    def dir_index(self,cluster):
+        index = self.dirindex.get(cluster)
+        if index is None:
+            dirs, files = self.read_dir(cluster,no_dotdirs=True)
+            index = {}
+            for de in dirs + files:
+                index.setdefault(de.decoded_name(),de)
+            self.dirindex[cluster] = index
+        return index
+
+    # resolves list of path segments, returns entry or None
+    def lookup(self,segments,cluster=0):
+        de = None
+        for segment in segments:
+            if not de is None:
+                if not de.is_dir(): return None
+                cluster = de.start
+            de = self.dir_index(cluster).get(segment)
+            if de is None: return None
+        return de
                      
     def read_dir(self,cluster=0,no_dotdirs=False):
+        cached = self.dircache.get(cluster)
+        if cached is None:
+            cached = self.read_dir_real(cluster)
+            self.dircache.put(cluster,cached)
+        dirs, files = cached
+        if no_dotdirs: dirs = [ d for d in dirs if not d.is_dotdir() ]
+        else:          dirs = list(dirs)
+        return (dirs,list(files))
+
+    def read_dir_real(self,cluster):
         dirs, files = [], []
-        data = cStringIO.StringIO(self.get_clusterdata(cluster,throw=True))
-        de = DirEntry(data=data)
-        counter = 0
-        while not de.is_empty():
-            if not de.is_erased():
+        while True:
+            entries = DirEntry.from_cluster(
+                self.get_clusterdata(cluster,throw=True))
+            for de in entries:
+                if de.is_erased(): continue
                 if de.has_attr(DirEntry.ATTR_VOLLABEL): pass
                 elif de.has_attr(DirEntry.ATTR_DIR):    dirs.append(de)
                 else:                                   files.append(de)
-            counter += 1
-            if counter*32 == self.bs.cluster_size():
-                cluster = self.fat.next_cluster(cluster)
-                if cluster == Fat12.TERM: break
-                counter = 0
-                data = cStringIO.StringIO(
-                    self.get_clusterdata(cluster,throw=True))
-            try:    de = DirEntry(data=data)
-            except: break
-        if no_dotdirs: dirs = [ d for d in dirs if not d.is_dotdir() ]
+            # stop at empty entry, end of root or truncated cluster
+            if cluster == 0 or \
+               len(entries)*DirEntry.SIZE < self.bs.cluster_size(): break
+            cluster = self.fat.next_cluster(cluster)
+            if cluster == Fat12.TERM: break
         return (dirs,files)
 
     def find_file(self,path):
@@ -372,34 +540,34 @@ class S3Image(object):
         if len(segments) and segments[0] == 'A:': segments = segments[1:]
         if not len(segments):
             raise S3Exception("findFile: malformed file path '%s'" % path)
-        dircluster = None
-        while True:
-            dirs, files = self.read_dir(dircluster)
-            if len(segments) > 1:
-                for d in dirs:
-                    if d.decoded_name() == segments[0]:
-                        segments = segments[1:]
-                        dircluster = d.start
-                        break
-                else: return None
-            else:
-                for f in files:
-                    if f.decoded_name() == segments[0]:
-                        return f
-                else: return None
+        f = self.lookup(segments)
+        if f is None or f.is_dir(): return None
+        return f
         
-    def extract_file(self,f,compatibilityMode=False):
-        buf = ''
+    # yields contents of file along its cluster chain, trimmed to file size
+    def iter_file(self,f,compatibilityMode=False):
         if self.debug: print("extract_file: cluster %d" % f.start)
-        chain = self.fat.get_chain(f.start)
-        for cluster in chain:
-            buf += self.get_clusterdata(cluster)
-        if f.size > len(buf):
+        remaining = f.size
+        for cluster in self.fat.get_chain(f.start):
+            if remaining <= 0: break
+            chunk = self.get_clusterdata(cluster)
+            if len(chunk) > remaining: chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+        if remaining > 0:
             s = "extract_file: unexpected end of file, %d/%d written" % \
-                (len(buf),f.size)
+                (f.size-remaining,f.size)
             if compatibilityMode: print("WARNING: "+s)
             else:                 raise S3Exception(s)
-        return buf[:f.size]
+
+    def extract_to(self,f,outfile,compatibilityMode=False):
+        for chunk in self.iter_file(f,compatibilityMode=compatibilityMode):
+            outfile.write(chunk)
+
+    def extract_file(self,f,compatibilityMode=False):
+        buf = cStringIO.StringIO()
+        self.extract_to(f,buf,compatibilityMode=compatibilityMode)
+        return buf.getvalue()
 
     def extract_all(self,targetdir,start=0,compatibilityMode=False):
         if not os.path.exists(targetdir): os.makedirs(targetdir)
@@ -410,7 +578,7 @@ class S3Image(object):
             try:
                 with open(outname,'wb') as outfile:
                     if self.debug: print("Writing '%s'" % outname)
-                    outfile.write(self.extract_file(f))
+                    self.extract_to(f,outfile)
                 os.utime(outname, time_conv_to_local(f.mdate,f.mtime))
             except S3Exception, e: raise
             except Exception, e:
@@ -429,24 +597,123 @@ class S3Image(object):
             os.utime(targetdir,
                      time_conv_to_local(self.get_voldate(),self.get_voltime()))
 
+    # imports host directory in passes: scan and plan the whole tree, check
+    # the free space, allocate all chains, then write directories and files
     def add_directory(self,path):
-        cut = len(path)
+        self.check_writable('add_directory')
+        tree = self.scan_directory(path)
+        tree['start'] = 0
+        needed = self.plan_directory(tree)
+        if needed > self.fat.nfree:
+            raise S3Exception("add_directory: %d clusters needed, only %d free"
+                              % (needed,self.fat.nfree))
+        self.set_voldate(tree['mdate'])
+        self.set_voltime(tree['mtime'])
+        self.allocate_directory(tree)
+        self.write_directory(tree,'')
+
+    def scan_directory(self,path,name=None,follow=True):
         mdate, mtime = time_conv_from_local(os.path.getmtime(path))
-        self.set_voldate(mdate)
-        self.set_voltime(mtime)
-        for root, dirs, files in os.walk(path):
-            newroot = root[cut:].replace('/','\\')
-            for orig,dn in [ (d,newroot + '\\' + d)
-                             for d in sorted(dirs,reverse=True) ]:
-                path  = os.path.join(root,orig)
-                mdate, mtime = time_conv_from_local(os.path.getmtime(path))
-                if self.debug: print("Adding dir  '%s'" % dn)
-                self.mkdir(encode_path(dn),mdate=mdate,mtime=mtime)
-            for orig,fn in [ (f,newroot + '\\' + f)
-                             for f in sorted(files,reverse=True) ]:
-                path = os.path.join(root,orig)
-                mdate, mtime = time_conv_from_local(os.path.getmtime(path))
-                with open(path,'rb') as f:
-                    if self.debug: print("Adding file '%s'" % fn)
-                    self.copy(encode_path(fn),f.read(),mdate=mdate,mtime=mtime)
-        
+        node = { 'name': name, 'path': path, 'mdate': mdate, 'mtime': mtime,
+                 'start': None, 'dirs': [], 'files': [] }
+        if not follow: return node
+        # entries in reverse order, like os.walk symlinked dirs stay empty
+        for orig in sorted(os.listdir(path),reverse=True):
+            fn = os.path.join(path,orig)
+            if os.path.isdir(fn):
+                node['dirs'].append(self.scan_directory(
+                    fn,encode_path(orig),follow=not os.path.islink(fn)))
+                continue
+            mdate, mtime = time_conv_from_local(os.path.getmtime(fn))
+            node['files'].append({ 'name': encode_path(orig), 'path': fn,
+                                   'size': os.path.getsize(fn),
+                                   'mdate': mdate, 'mtime': mtime })
+        return node
+
+    # resolves existing directories, returns number of clusters needed
+    def plan_directory(self,node):
+        perCluster = self.bs.cluster_size()/DirEntry.SIZE
+        if node['start'] is None: index = {}
+        else:                     index = self.dir_index(node['start'])
+        needed, nentries = 0, 0
+        for d in node['dirs']:
+            de = index.get(d['name'])
+            if de is None:
+                nentries += 1
+            elif de.is_dir():
+                d['start'] = de.start
+            else:
+                raise S3Exception("add_directory: '%s' is not a directory" %
+                                  d['path'])
+            needed += self.plan_directory(d)
+        for f in node['files']:
+            if f['name'] in index:
+                raise S3Exception("file already exists")
+            needed   += self.nclusters_for(f['size'])
+            nentries += 1
+        if node['start'] is None:
+            node['nclusters'] = (2+nentries+perCluster-1)/perCluster
+            return needed + node['nclusters']
+        missing = nentries - self.free_slots(node['start'])
+        if missing <= 0: return needed
+        if node['start'] == 0:
+            raise S3Exception("maximum number of root entries reached")
+        return needed + (missing+perCluster-1)/perCluster
+
+    def allocate_directory(self,node):
+        for d in node['dirs']:
+            if d['start'] is None:
+                d['chain'] = self.fat.create_chain(d['nclusters'])
+        for f in node['files']:
+            f['chain'] = self.fat.create_chain(self.nclusters_for(f['size']))
+        for d in node['dirs']:
+            self.allocate_directory(d)
+
+    def write_directory(self,node,path):
+        entries = []
+        for d in node['dirs']:
+            if self.debug: print("Adding dir  '%s\\%s'" % (path,d['name']))
+            if not d['start'] is None: continue
+            de = DirEntry(attr=DirEntry.ATTR_DIR,start=d['chain'][0],
+                          mdate=d['mdate'],mtime=d['mtime'])
+            de.encode_name(d['name'])
+            entries.append(de)
+        for f in node['files']:
+            if self.debug: print("Adding file '%s\\%s'" % (path,f['name']))
+            de = DirEntry(start=f['chain'][0],size=f['size'],
+                          mdate=f['mdate'],mtime=f['mtime'])
+            de.encode_name(f['name'])
+            entries.append(de)
+
+        if node['start'] is None:
+            # new directory, written in one go
+            node['start'] = node['chain'][0]
+            dot = DirEntry(attr=DirEntry.ATTR_DIR,start=node['start'],
+                           mdate=node['mdate'],mtime=node['mtime'])
+            dot.set_name('.')
+            dotdot = DirEntry(attr=DirEntry.ATTR_DIR,start=node['parent'],
+                              mdate=node['mdate'],mtime=node['mtime'])
+            dotdot.set_name('..')
+            entries = [ dot, dotdot ] + entries
+            data = bytearray(len(entries)*DirEntry.SIZE)
+            for i,de in enumerate(entries):
+                de.pack_into(data,i*DirEntry.SIZE)
+            self.write_chain(node['chain'],data)
+            self.dircache.pop(node['start'])
+            self.dirindex.pop(node['start'],None)
+        else:
+            for de in entries:
+                self.add_direntry(node['start'],de)
+
+        for f in node['files']:
+            with open(f['path'],'rb') as infile:
+                data = infile.read()
+            if len(data) != f['size']:
+                raise S3Exception("add_directory: '%s' changed size" %
+                                  f['path'])
+            self.write_chain(f['chain'],data)
+        for d in node['dirs']:
+            d['parent'] = node['start']
+            self.write_directory(d,path+'\\'+d['name'])
+
+S3Image.DIRCACHE_SIZE = 64
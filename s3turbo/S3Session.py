@@ -0,0 +1,224 @@
+from __future__ import print_function
+import collections, time
+
+from s3turbo.MSCEIMessage import MSCEIMessage
+from s3turbo.MSCEISchema  import decode
+from s3turbo.S3Turbo      import S3Exception, S3FunctionName
+from s3turbo.Util         import is_sysex, str2file, str2hex
+
+# pending operation of an S3Session, works like a future; iterating over it
+# yields data chunks as they arrive
+class S3Request(object):
+    PENDING, RUNNING, DONE, FAILED, CANCELLED = range(5)
+
+    def __init__(self,session,msg,handler,cancel_name):
+        self.session     = session
+        self.msg         = msg
+        self.handler     = handler
+        self.cancel_name = cancel_name
+        self.state       = S3Request.PENDING
+        self.value       = None
+        self.error       = None
+        self.chunks      = collections.deque()
+        self.callbacks   = []
+        self.deadline    = None
+        # request is complete after idle time instead of timing out
+        self.idle_done   = False
+
+    def done(self):
+        return self.state >= S3Request.DONE
+
+    def result(self,timeout=None):
+        self.session.wait(self,timeout)
+        if self.state == S3Request.FAILED: raise self.error
+        if self.state == S3Request.CANCELLED:
+            raise S3Exception("request cancelled")
+        return self.value
+
+    def cancel(self):
+        return self.session.cancel(self)
+
+    def add_done_callback(self,func):
+        if self.done(): func(self)
+        else:           self.callbacks.append(func)
+
+    def __iter__(self):
+        while True:
+            while not len(self.chunks) and not self.done():
+                self.session.pump()
+            if len(self.chunks):
+                yield self.chunks.popleft()
+            else:
+                self.result()
+                return
+
+    def finish(self,value=None,error=None,state=None):
+        if self.done(): return
+        if state is None:
+            state = S3Request.FAILED if error else S3Request.DONE
+        self.state = state
+        self.value = value
+        self.error = error
+        for func in self.callbacks: func(self)
+        self.session.next(self)
+
+# request/response API for the host side of the MSCEI protocol. Requests are
+# queued and run one at a time, any pending request can be waited for
+class S3Session(object):
+    def __init__(self,midi,timeout=5.,idle=1.,debug=False):
+        self.midi    = midi
+        self.timeout = timeout
+        self.idle    = idle
+        self.debug   = debug
+        self.queue   = collections.deque()
+        self.current = None
+
+    def status(self):
+        return self.submit(MSCEIMessage(fromName="STAT_REQUEST"),
+                           S3Session.handleStatus,"D_CANCEL")
+
+    # entries of directory path matching pattern, complete after idle time
+    def list_dir(self,path,pattern='*'):
+        return self.submit(
+            MSCEIMessage(*(str2file(pattern)+str2hex(dir_path(path))),
+                         fromName="DIR_DRQ"),
+            S3Session.handleDirEntry,"F_CANCEL")
+
+    def read_file(self,path):
+        dirname, filename = split_path(path)
+        r = self.submit(
+            MSCEIMessage(*(str2file(filename)+str2hex(dirname)),
+                         fromName="F_DREQ"),
+            S3Session.handleFileDump,"F_CANCEL")
+        r.value = []
+        return r
+
+    # waits for all requests and returns their results
+    def run(self,*requests):
+        return [ r.result() for r in requests ]
+
+    def submit(self,msg,handler,cancel_name):
+        r = S3Request(self,msg,handler,cancel_name)
+        self.queue.append(r)
+        if self.current is None: self.next()
+        return r
+
+    def next(self,finished=None):
+        if not finished is None and not finished is self.current: return
+        self.current = None
+        while len(self.queue):
+            r = self.queue.popleft()
+            if r.state == S3Request.PENDING: break
+        else:
+            return
+        self.current = r
+        r.state    = S3Request.RUNNING
+        r.deadline = time.time() + self.timeout
+        self.send(r.msg)
+
+    def cancel(self,r):
+        if r.done(): return False
+        if r is self.current:
+            self.send(MSCEIMessage(fromName=r.cancel_name))
+        r.finish(state=S3Request.CANCELLED)
+        return True
+
+    def send(self,msg):
+        if isinstance(msg,MSCEIMessage): msg = msg.raw()
+        self.midi.send((0,msg))
+
+    def reply(self,*names):
+        for name in names: self.send(MSCEIMessage.handshake(name))
+
+    def wait(self,r,timeout=None):
+        end = None if timeout is None else time.time()+timeout
+        while not r.done():
+            if not end is None and time.time() > end:
+                raise S3Exception("timeout waiting for request")
+            self.pump()
+
+    # processes at most one incoming message and checks for timeouts
+    def pump(self,timeout=None):
+        if timeout is None: timeout = S3Session.POLL
+        if self.midi.poll(timeout):
+            timestamp, msg = self.midi.recv()
+            self.dispatch(msg)
+        r = self.current
+        if r is None or time.time() < r.deadline: return
+        if r.idle_done:
+            r.finish(r.value)
+        else:
+            self.send(MSCEIMessage(fromName=r.cancel_name))
+            r.finish(error=S3Exception("timeout, no answer from device"))
+
+    def dispatch(self,msg):
+        r = self.current
+        if not len(msg) or not is_sysex(msg) or msg[1] != 0x2F:
+            if self.debug: print("S3Session: ignoring", msg)
+            return
+        fname = S3FunctionName(msg)
+        if self.debug: print("S3Session: received", fname)
+        if r is None or fname in [ "F_WAIT", "D_WAIT", "F_ACK", "D_ACK" ]:
+            return
+        if fname in [ "F_ERR", "D_ERR" ]:
+            r.finish(error=S3Exception("device error %d" % msg[5]))
+        elif fname in [ "F_CANCEL", "D_CANCEL" ]:
+            r.finish(error=S3Exception("cancelled by device"))
+        else:
+            r.deadline = time.time() + (self.idle if r.idle_done
+                                        else self.timeout)
+            r.handler(self,r,fname,decode(fname,msg))
+
+    # handlers, called with the current request and the decoded message
+    def handleStatus(self,r,fname,rec):
+        if fname != "STAT_ANSWER": return
+        if not rec.valid: return self.reply("D_NACK")
+        self.reply("D_WAIT","D_ACK")
+        r.finish(dict([ (k,getattr(rec,k)) for k in [
+            "iClass", "iSubClass", "iRelease", "TotalMem", "FreeMem",
+            "FreeSampleMem", "ReadyFor", "ActBankPerf" ] ]))
+
+    # entries are DIR_HDR records
+    def handleDirEntry(self,r,fname,rec):
+        if fname != "DIR_HDR": return
+        if not rec.valid: return self.reply("F_NACK")
+        self.reply("F_WAIT","F_ACK")
+        if r.value is None: r.value = []
+        r.idle_done = True
+        r.deadline  = time.time() + self.idle
+        if rec.filename == '='*11: return
+        r.value.append(rec)
+        r.chunks.append(rec)
+
+    def handleFileDump(self,r,fname,rec):
+        if fname == "F_DHDR":
+            if not rec.valid: return self.reply("F_NACK")
+            self.reply("F_WAIT","F_ACK")
+            r.remaining = rec.length
+            self.chunk(r,rec.data[8:14])
+        elif fname == "F_DPKT" and hasattr(r,'remaining'):
+            if not rec.valid: return self.reply("F_NACK")
+            self.reply("F_WAIT","F_ACK")
+            self.chunk(r,rec.data)
+
+    def chunk(self,r,data):
+        data = str(data[:r.remaining])
+        r.remaining -= len(data)
+        r.value.append(data)
+        r.chunks.append(data)
+        if r.remaining <= 0: r.finish(''.join(r.value))
+
+S3Session.POLL = 0.05
+
+# path with trailing backslash, as expected by the device
+def dir_path(path):
+    if not path.endswith('\\'): path += '\\'
+    return path
+
+# splits 'A:\DIR\NAME.EXT' into directory and 11 character file name
+def split_path(path):
+    dirname, sep, filename = path.rpartition('\\')
+    if '.' in filename:
+        name, ext = filename.rsplit('.',1)
+        filename  = name[:8].ljust(8) + ext[:3]
+    return dir_path(dirname), filename
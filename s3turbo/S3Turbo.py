@@ -54,14 +54,27 @@ S3Functions = OrderedDict([
     ("RAM_DUMP"               , (0x5, 0x00, False)), # = STATUS REQUEST
 ])
 
+# names sharing the code of another function, never returned by S3FunctionName
+S3FunctionAliases = {
+    "RAM_DUMP": "STAT_REQUEST",
+}
+
+# (function, subfunction) -> name
+S3FunctionTable = {}
+for k,v in S3Functions.iteritems():
+    if k in S3FunctionAliases:
+        if S3Functions[S3FunctionAliases[k]][:2] != v[:2]:
+            raise ValueError("alias %s does not match %s" %
+                             (k,S3FunctionAliases[k]))
+        continue
+    if v[:2] in S3FunctionTable:
+        raise ValueError("%s and %s share a code, declare an alias" %
+                         (k,S3FunctionTable[v[:2]]))
+    S3FunctionTable[v[:2]] = k
+
 # Tries to match message to S3 function
 def S3FunctionName(msg):
-    func    = (msg[2] >> 4)
-    subfunc = msg[3]
-    for k,v in S3Functions.iteritems():
-        if v[:2] == (func,subfunc):
-            return k
-    return None
+    return S3FunctionTable.get((msg[2] >> 4, msg[3]))
 
 # not used but defined in manual
 class S3HandshakeMessage(object):
@@ -1,7 +1,8 @@
-import time, os
+import time, os, mmap, json
 from progress.bar import IncrementalBar
 
-from s3turbo.Util import checksum, u2s, writeWAV
+from s3turbo.Telemetry import Telemetry
+from s3turbo.Util      import checksum, u2s, writeWAV
 
 class HandshakeMessage(object):
     @staticmethod
@@ -34,10 +35,15 @@ class HandshakeMessage(object):
         return [ 0xF0, 0x7E, target, subid, packetnumber, 0xF7 ]
 
 class SampleDumpHandler(object):
-    def __init__(self,debug=False,samplelist=None):
+    # sidecar enables caching of packet indices next to the SDS files
+    def __init__(self,debug=False,samplelist=None,telemetry=None,
+                 sidecar=False):
         super(SampleDumpHandler,self).__init__()
         self.debug=debug
         self.samplelist = samplelist
+        self.telemetry = telemetry if telemetry else Telemetry()
+        self.sidecar = sidecar
+        self.sds = None
         self.reset()
         
     def __del__(self):
@@ -48,13 +54,21 @@ class SampleDumpHandler(object):
         self.header  = {}
         self.data = []
         self.lastpacket = 0
+        # NAK was sent for the last packet, the next one is a resend
+        self.resend = False
         self.raw = []
         self.packetcounter = 0
         self.dump_start = 0
+        # upload: mapped SDS file and end offsets of its messages
+        if self.sds: self.sds.close()
+        self.sds = None
+        self.ends = []
         self.exppacket = 0
         self.starttime = 0
         
     def parse(self,msg):
+        rxtime = time.time()
+        self.telemetry.packet('rx',len(msg),rxtime)
         status = None
         if msg[3] == 0x1:
             status = self.parseHeader(msg)
@@ -64,6 +78,13 @@ class SampleDumpHandler(object):
             status = self.parseRequest(msg)
         elif msg[3] == 0x7F and self.dump_start > 0:
             status = self.continueDump()
+        if not status: return status
+        if status[3] == 0x7F:
+            self.telemetry.record('ack_latency',time.time()-rxtime)
+        elif status[3] == 0x7E:
+            self.telemetry.count('nak_sent')
+        elif status[3] in [ 0x1, 0x2 ]:
+            self.telemetry.packet('tx',len(status))
         return status
     
     def parseHeader(self, msg):
@@ -103,8 +124,11 @@ class SampleDumpHandler(object):
         return HandshakeMessage.ACK(packetnumber=self.lastpacket)
     
     def parsePacket(self, msg):
+        resend, self.resend = self.resend, False
+        if resend: self.telemetry.count('retry')
         if not 0xF7 in msg:
             print "printSampleDumpDataPacket: could not find EOX"
+            self.resend = True
             return HandshakeMessage.NAK(packetnumber=self.lastpacket)
         
         cs = msg.index(0xF7)-1
@@ -117,7 +141,11 @@ class SampleDumpHandler(object):
                 "(calculated 0x%x)" % calced_cs
         if msg[cs] != calced_cs:
             print "Checksum mismatch:", hex(msg[cs]), "should be", hex(calced_cs)
+            self.resend = True
             return HandshakeMessage.NAK(packetnumber=self.lastpacket)
+        # repeated packet, our ACK was lost
+        if not resend and self.packetcounter and msg[4] == self.lastpacket:
+            self.telemetry.count('retry')
         offset = 5
         format = int(self.header['sample_format'])
 
@@ -156,34 +184,62 @@ class SampleDumpHandler(object):
             print "No sample to send"
             return HandshakeMessage.Cancel(packetnumber=self.lastpacket)
             
-        f = open(samplefile, "rb")
-        self.raw = [ ord(i) for i in f.read() ]
-        f.close()
-        n = self.raw.count(0xF7)
+        if os.path.getsize(samplefile):
+            with open(samplefile, "rb") as f:
+                self.sds = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            self.ends = self.loadIndex(samplefile)
+        n = len(self.ends)
         if n > 0:
             print "Sending", n, "Sample Dump Packets (+ header)"
             self.starttime = time.time()
-            self.dump_start = self.raw.index(0xF7)+1
-            self.packetcounter += 1
-            return self.raw[:self.dump_start]
+            return self.nextPacket()
         
         return HandshakeMessage.Cancel(packetnumber=self.lastpacket)
 
     def continueDump(self):
-        n = self.raw[self.dump_start:].count(0xF7)
-        if n == 0:
+        if self.packetcounter == len(self.ends):
             elapsed = time.time()-self.starttime
             print "Sent %d packets in %.1f seconds (%.1f bytes/sec)" % (
-                self.packetcounter, elapsed, len(self.raw)/elapsed)
+                self.packetcounter, elapsed, self.dump_start/elapsed)
             self.reset()
             return HandshakeMessage.EOF(packetnumber=self.lastpacket)
         
-        ds = self.dump_start
-        self.dump_start = self.raw.index(0xF7,self.dump_start)+1
         if self.packetcounter % 100 == 0:
             print "Sent %d packets" % self.packetcounter
+        return self.nextPacket()
+
+    # the same amount of work for every packet, independent of position
+    def nextPacket(self):
+        ds = self.dump_start
+        self.dump_start = self.ends[self.packetcounter]
         self.packetcounter += 1
-        return self.raw[ds:self.dump_start]
+        return list(bytearray(buffer(self.sds,ds,self.dump_start-ds)))
+
+    # end offsets of all messages in the mapped SDS file, read from or
+    # written to the sidecar file if enabled
+    def loadIndex(self,samplefile):
+        st = os.stat(samplefile)
+        key = { 'mtime': st.st_mtime, 'size': st.st_size }
+        idxfile = samplefile + SampleDumpHandler.INDEX_SUFFIX
+        if self.sidecar and os.path.exists(idxfile):
+            try:
+                with open(idxfile) as f:
+                    idx = json.load(f)
+                if idx.get('key') == key: return idx['ends']
+            except (IOError, ValueError), e:
+                print "Ignoring index", repr(idxfile), e
+        ends = []
+        pos = self.sds.find('\xF7')
+        while pos >= 0:
+            ends.append(pos+1)
+            pos = self.sds.find('\xF7',pos+1)
+        if self.sidecar:
+            try:
+                with open(idxfile,'w') as f:
+                    json.dump({ 'key': key, 'ends': ends },f)
+            except IOError, e:
+                print "Could not write index", repr(idxfile), e
+        return ends
         
     def saveFile(self, filename=None):
         self.bar.finish()
@@ -239,3 +295,5 @@ class SampleDumpHandler(object):
                 [ "file_%s: %s.%s\n" % (suffix,filename,suffix) for suffix in [
                     'sds', 'raw', 'dmp', 'wav' ] ])
         self.reset()
+
+SampleDumpHandler.INDEX_SUFFIX = '.idx'
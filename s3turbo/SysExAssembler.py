@@ -0,0 +1,86 @@
+import re
+
+# reassembles SysEx messages from fragments of MIDI input. Only new bytes are
+# searched for the end of a message, so the cost is linear in bytes received.
+# Real-time bytes may appear anywhere and are passed on as separate messages.
+# Messages matching msgfilter (a MessageFilter) are dropped before copying
+class SysExAssembler(object):
+    def __init__(self,maxlen=None,msgfilter=None):
+        self.maxlen    = maxlen if maxlen else SysExAssembler.MAXLEN
+        self.filter    = msgfilter if msgfilter and len(msgfilter) else None
+        self.buf       = None
+        self.timestamp = None
+        # dropping rest of an oversized message
+        self.skip      = False
+        # number of incomplete and oversized messages that were dropped
+        self.incomplete = 0
+        self.overflows  = 0
+
+    def reset(self):
+        self.buf       = None
+        self.timestamp = None
+        self.skip      = False
+
+    # returns list of complete (timestamp, message) tuples
+    def feed(self,data,timestamp=0):
+        if not len(data): return []
+        # real-time event is a single byte, pypm pads it to 4 bytes
+        if data[0] >= 0xF8:
+            if self.filter and self.filter.match((data[0],)): return []
+            return [ (timestamp,[ data[0] ]) ]
+        # complete channel message outside SysEx
+        if self.filter and self.buf is None and not self.skip and \
+           0x80 <= data[0] < 0xF0 and self.filter.match(data):
+            return []
+        data = bytearray(data)
+        out  = []
+        if SysExAssembler.realtime.search(data):
+            out += [ (timestamp,[ b ]) for b in data if b >= 0xF8 and
+                     not (self.filter and self.filter.match((b,))) ]
+            data = data.translate(None,SysExAssembler.REALTIME)
+        pos = 0
+        while pos < len(data):
+            if self.skip:
+                m = SysExAssembler.status.search(data,pos)
+                if m is None: break
+                pos = m.start() + (data[m.start()] == 0xF7)
+                self.skip = False
+                continue
+            if self.buf is None:
+                if data[pos] == 0xF0:
+                    self.buf       = bytearray([ 0xF0 ])
+                    self.timestamp = timestamp
+                    pos += 1
+                    continue
+                # other messages are complete, skip padding after SysEx
+                if data[pos] & 0x80: self.emit(out,timestamp,data[pos:])
+                break
+            m   = SysExAssembler.status.search(data,pos)
+            end = m.start() if m else len(data)
+            self.buf += data[pos:end]
+            if len(self.buf) >= self.maxlen:
+                self.overflows += 1
+                self.buf  = None
+                self.skip = True
+                pos = end
+                continue
+            if m is None: break
+            if data[end] == 0xF7:
+                self.buf.append(0xF7)
+                self.emit(out,self.timestamp,self.buf)
+                pos = end+1
+            else:
+                # new status byte terminates the message
+                self.incomplete += 1
+                pos = end
+            self.buf = None
+        return out
+
+    def emit(self,out,timestamp,msg):
+        if self.filter and self.filter.match(msg): return
+        out.append((timestamp,list(msg)))
+
+SysExAssembler.MAXLEN   = 1 << 16
+SysExAssembler.REALTIME = ''.join([ chr(b) for b in xrange(0xF8,0x100) ])
+SysExAssembler.realtime = re.compile(r'[\xF8-\xFF]')
+SysExAssembler.status   = re.compile(r'[\x80-\xF7]')
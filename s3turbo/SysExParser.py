@@ -1,18 +1,21 @@
-import time, struct
+import time, mmap
 from progress.bar import IncrementalBar
 
 from s3turbo.MessagePrinter import MessagePrinter
 from s3turbo.MSCEIMessage   import MSCEIMessage
+from s3turbo.MSCEISchema    import decode
 from s3turbo.S3Turbo        import S3FunctionName
-from s3turbo.Util           import checksum, conv7_8, noop, cancel, hexdump
-from s3turbo.Util           import mktimestamp, list2str
+from s3turbo.Telemetry      import Telemetry
+from s3turbo.Util           import noop, cancel, hexdump, mktimestamp
 
 class SysExParser(object):
-    def __init__(self,send_func,debug=False):
+    def __init__(self,send_func,debug=False,telemetry=None):
         super(SysExParser,self).__init__()
         self.send_func  = send_func
         self.debug      = debug
+        self.telemetry  = telemetry if telemetry else Telemetry()
         self.dump_file  = None
+        self.dump_buf   = None
         self.dump_on    = False
         self.dump_ram   = False
         self.printer    = MessagePrinter(debug=self.debug)
@@ -41,22 +44,37 @@ class SysExParser(object):
     def __del__(self):
         self.closeDumpFile()
 
+    # output file is preallocated and mapped, packets go to their offsets
     def createDumpFile(self,filename=None):
         if not filename:
             timestamp = time.strftime("%Y%m%d%H%M%S")
             filename="dump_%s.bin" % mktimestamp()
-        self.dump_file = open(filename,"wb")
-        
+        self.dump_file = open(filename,"w+b")
+        if self.dump_size > 0:
+            self.dump_file.truncate(self.dump_size)
+            self.dump_buf = mmap.mmap(self.dump_file.fileno(),self.dump_size)
+
     def closeDumpFile(self):
         if not self.dump_file: return
+        if self.dump_buf:
+            self.dump_buf.flush()
+            self.dump_buf.close()
+            self.dump_buf = None
+        # cut off unreceived part
+        self.dump_file.truncate(self.dump_written)
         self.dump_file.close()
         self.dump_file = None
 
+    # data received so far, can be inspected while the dump is running
+    def dumpBuffer(self):
+        if not self.dump_buf: return buffer('')
+        return buffer(self.dump_buf,0,self.dump_written)
+
     def startDump(self,filename,size):
         if not self.dump_on: return
+        self.closeDumpFile()
         self.dump_written = 0
         self.dump_size = size
-        self.closeDumpFile()
         self.createDumpFile(filename)
         print "Dumping '%s'" % filename
         showsize = ' 0x%(index)06x' if self.dump_ram else ''
@@ -76,129 +94,72 @@ class SysExParser(object):
             self.createDumpFile()
         if self.dump_written == self.dump_size:
             print "Discarding", len(data), "bytes, dump has ended"
-        elif len(data) + self.dump_written > self.dump_size:
-            discard = len(data) + self.dump_written - self.dump_size
-            self.dump_file.write(bytearray(data[:-discard]))
-            self.bar.next(self.dump_size-self.dump_written)
-            self.dump_written = self.dump_size
+            return
+        n = min(len(data),self.dump_size-self.dump_written)
+        self.dump_buf.seek(self.dump_written)
+        self.dump_buf.write(buffer(data,0,n))
+        self.dump_written += n
+        self.bar.next(n)
+        self.telemetry.packet('dump',n)
+        if n < len(data):
             self.bar.finish()
-            leftover = data[-discard:]
-            for i in leftover:
-                if i != 0:
-                    print "Discarding non-NUL data:", hexdump(leftover)
-                    break
-        else:
-            self.dump_file.write(bytearray(data))
-            self.dump_written += len(data)
-            self.bar.next(len(data))
+            leftover = data[n:]
+            if leftover.strip(b'\x00'):
+                print "Discarding non-NUL data:", hexdump(leftover)
         
     # FILE FUNCTIONS  FILE_F
-    def handleFileDumpHeader(self,msg,timestamp):
-        self.sendSysEx( MSCEIMessage(fromName="F_WAIT"),timestamp=timestamp+1)
-        offset=17
-        data = []
-        for i in xrange(2):
-            data += conv7_8(msg[offset:offset+8])
-            offset += 8
-        location = ''
-        while msg[offset] != 0:
-            location += chr(msg[offset])
-            offset += 1
-        offset+=1
-        cc = msg[offset]
-        cc_calc = checksum(msg[1:offset])
-        if cc == cc_calc:
-            filename = str(bytearray(msg[5:16])).strip()
-            length = struct.unpack('>I',list2str(data[4:8]))[0]
-            self.startDump(filename,length)
-            self.dump(data[8:])
-            self.sendSysEx( MSCEIMessage(fromName="F_ACK"),
-                            timestamp=timestamp+2)
+    def handleFileDumpHeader(self,msg,timestamp,rec):
+        self.sendHandshake("F_WAIT",timestamp=timestamp+1)
+        if rec.valid:
+            self.startDump(rec.filename.strip(),rec.length)
+            self.dump(rec.data[8:])
+            self.sendHandshake("F_ACK",timestamp=timestamp+2)
         else:
-            self.sendSysEx( MSCEIMessage(fromName="F_NACK"),
-                            timestamp=timestamp+2)
+            self.sendHandshake("F_NACK",timestamp=timestamp+2)
         return True
         
-    def handleFileDumpDataBlock(self,msg,timestamp):
-        self.sendSysEx( MSCEIMessage(fromName="F_WAIT"),timestamp=timestamp+1)
-        noctets = msg[5]
-        offset=6
-        data = []
-        for i in xrange(noctets):
-            data += conv7_8(msg[offset:offset+8])
-            offset += 8
-        cc = msg[offset]
-        cc_calc = checksum(msg[1:offset])
-        if cc == cc_calc:
-            self.dump(data)
-            self.sendSysEx( MSCEIMessage(fromName="F_ACK"),
-                            timestamp=timestamp+2)
+    def handleFileDumpDataBlock(self,msg,timestamp,rec):
+        self.sendHandshake("F_WAIT",timestamp=timestamp+1)
+        if rec.valid:
+            self.dump(rec.data)
+            self.sendHandshake("F_ACK",timestamp=timestamp+2)
         else:
-            self.sendSysEx( MSCEIMessage(fromName="F_NACK"),
-                            timestamp=timestamp+2)
+            self.sendHandshake("F_NACK",timestamp=timestamp+2)
         return True
 
     # DEVICE COMMAND  DEVICE_CMD
-    def handleStatusAnswer(self,msg,timestamp):
-        self.sendSysEx( MSCEIMessage(fromName="D_WAIT"),timestamp=timestamp+1)
-        offset= 5 + 3*8
-        cc = msg[offset]
-        cc_calc = checksum(msg[1:offset])
-        if cc == cc_calc:
-            self.sendSysEx( MSCEIMessage(fromName="D_ACK"),
-                            timestamp=timestamp+2)
+    def handleStatusAnswer(self,msg,timestamp,rec):
+        self.sendHandshake("D_WAIT",timestamp=timestamp+1)
+        if rec.valid:
+            self.sendHandshake("D_ACK",timestamp=timestamp+2)
             if self.dump_ram:
                 self.dump_on = True
                 self.startDump("ramdump_%s.bin" % mktimestamp(), 2097060)
                 time.sleep(0.1)
-                self.sendSysEx( MSCEIMessage(fromName="F_ACK"),
-                                timestamp=timestamp+3)
+                self.sendHandshake("F_ACK",timestamp=timestamp+3)
                 return True
         else:
-            self.sendSysEx( MSCEIMessage(fromName="D_NACK"),
-                            timestamp=timestamp+2)
+            self.sendHandshake("D_NACK",timestamp=timestamp+2)
         return False
 
-    def handleDataDump(self,msg,timestamp):
-        self.sendSysEx( MSCEIMessage(fromName="D_WAIT"))
-        noctets = msg[5]
-        offset=6
-        data = []
-        for i in xrange(noctets):
-            data += conv7_8(msg[offset:offset+8])
-            offset += 8
-        cc = msg[offset]
-        cc_calc = checksum(msg[1:offset])
-        if cc == cc_calc:
-            self.dump(data)
-            self.sendSysEx( MSCEIMessage(fromName="D_ACK"),
-                            timestamp=timestamp+2)
+    def handleDataDump(self,msg,timestamp,rec):
+        self.sendHandshake("D_WAIT")
+        if rec.valid:
+            self.dump(rec.data)
+            self.sendHandshake("D_ACK",timestamp=timestamp+2)
         else:
-            self.sendSysEx( MSCEIMessage(fromName="D_NACK"),
-                            timestamp=timestamp+2)
+            self.sendHandshake("D_NACK",timestamp=timestamp+2)
         return True
 
-    def handleDirectoryAnswer(self,msg,timestamp):
+    def handleDirectoryAnswer(self,msg,timestamp,rec):
         #time.sleep(0.1)
-        self.sendSysEx( MSCEIMessage(fromName="D_WAIT"),timestamp=timestamp+1)
-        offset = 8 + 11 + 1
-        data = []
-        for i in xrange(2):
-            data += conv7_8(msg[offset:offset+8])
-            offset += 8
-        offset += 11
-        cc = msg[offset]
-        cc_calc = checksum(msg[1:offset])
-        if cc == cc_calc:
-            filename = str(bytearray(msg[8:19])).strip()
-            length = struct.unpack('>I',list2str(data[4:8]))[0]
-            self.startDump(filename,length)
+        self.sendHandshake("D_WAIT",timestamp=timestamp+1)
+        if rec.valid:
+            self.startDump(rec.filename1.strip(),rec.length)
             #time.sleep(0.1)
-            self.sendSysEx( MSCEIMessage(fromName="D_ACK"),
-                            timestamp=timestamp+2)
+            self.sendHandshake("D_ACK",timestamp=timestamp+2)
         else:
-            self.sendSysEx( MSCEIMessage(fromName="D_NACK"),
-                            timestamp=timestamp+2)
+            self.sendHandshake("D_NACK",timestamp=timestamp+2)
         return True
         
     def parse(self, msg, timestamp, acceptUnhandled=True):
@@ -215,12 +176,29 @@ class SysExParser(object):
             return acceptUnhandled
         
         if self.debug: print "Received", fname, "@", timestamp
-        self.printer.handle(fname,msg)
+        self.telemetry.packet('rx',len(msg))
+        if fname in self.nak_names: self.telemetry.count('nak_received')
+        # decoded once for printer and handler
+        rec = decode(fname,msg)
+        self.printer.handle(fname,msg,rec)
         if fname in self.dump_stop: self.stopDump()
         handler = self.handlers.get(fname, None)
-        if handler: return handler(msg,timestamp=timestamp)
+        if handler: return handler(msg,timestamp=timestamp,rec=rec)
         else:       print fname, [ hex(b) for b in msg ]
 
+    # fast path for parameterless replies, skips classification and printing
+    def sendHandshake(self,fname,timestamp=0):
+        if self.debug: print "Sending ", fname, "@", timestamp
+        if fname in self.ack_names:
+            latency = self.telemetry.since('rx')
+            if not latency is None:
+                self.telemetry.record('ack_latency',latency)
+        elif fname in self.nak_names:
+            self.telemetry.count('nak_sent')
+        raw = MSCEIMessage.handshake(fname)
+        self.telemetry.packet('tx',len(raw))
+        self.send_func( (timestamp,raw))
+
     def sendSysEx(self,msg,timestamp=0):
         if msg.name:
             fname = msg.name
@@ -228,9 +206,20 @@ class SysExParser(object):
             fname = S3FunctionName(msg.raw())
         if fname:
             if self.debug: print "Sending ", fname, "@", timestamp
+            if fname in self.ack_names:
+                latency = self.telemetry.since('rx')
+                if not latency is None:
+                    self.telemetry.record('ack_latency',latency)
+            elif fname in self.nak_names:
+                self.telemetry.count('nak_sent')
             self.printer.handle(fname,msg)
             if fname in self.dump_start:
                 self.dump_on = True
             elif fname == 'RAM_DUMP':
                 self.dump_ram = True
-        self.send_func( (timestamp,msg.raw()))
+        raw = msg.frozen()
+        self.telemetry.packet('tx',len(raw))
+        self.send_func( (timestamp,raw))
+
+SysExParser.ack_names = [ "F_ACK",  "D_ACK"  ]
+SysExParser.nak_names = [ "F_NACK", "D_NACK" ]
@@ -0,0 +1,93 @@
+import time, math, json
+
+# histogram with power-of-two buckets, keyed by their upper bound
+class Histogram(object):
+    def __init__(self):
+        self.buckets = {}
+        self.count   = 0
+        self.sum     = 0.
+        self.min     = None
+        self.max     = None
+
+    def add(self,value):
+        # exact, math.log misplaces some powers of two
+        if value <= 0:
+            bucket = 0.
+        elif isinstance(value,(int,long)):
+            bucket = float(1 << (value-1).bit_length())
+        else:
+            m, e   = math.frexp(value)
+            bucket = math.ldexp(1.,e-1 if m == 0.5 else e)
+        self.buckets[bucket] = self.buckets.get(bucket,0) + 1
+        self.count += 1
+        self.sum   += value
+        if self.min is None or value < self.min: self.min = value
+        if self.max is None or value > self.max: self.max = value
+
+    def to_dict(self):
+        return {
+            'count':   self.count,
+            'sum':     self.sum,
+            'min':     self.min,
+            'max':     self.max,
+            'mean':    self.sum/self.count if self.count else None,
+            'buckets': [ [ b, n ] for b,n in sorted(self.buckets.iteritems()) ],
+        }
+
+# per-session transfer statistics: histograms, counters and timestamps
+class Telemetry(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters   = {}
+        self.marks      = {}
+        self.starttime  = time.time()
+
+    def record(self,name,value):
+        h = self.histograms.get(name)
+        if h is None: h = self.histograms[name] = Histogram()
+        h.add(value)
+
+    def count(self,name,n=1):
+        self.counters[name] = self.counters.get(name,0) + n
+
+    # remembers time of event name, returns time since the previous one
+    def mark(self,name,now=None):
+        if now is None: now = time.time()
+        last = self.marks.get(name)
+        self.marks[name] = now
+        if last is None: return None
+        return now-last
+
+    # time elapsed since event name, None if it did not happen yet
+    def since(self,name,now=None):
+        if not name in self.marks: return None
+        if now is None: now = time.time()
+        return now-self.marks[name]
+
+    # packet of nbytes, records gap to previous packet and its rate
+    def packet(self,name,nbytes,now=None):
+        gap = self.mark(name,now)
+        self.count(name+'_packets')
+        self.count(name+'_bytes',nbytes)
+        self.record(name+'_size',nbytes)
+        if gap is None: return
+        self.record(name+'_gap',gap)
+        if gap > 0: self.record(name+'_rate',nbytes/gap)
+
+    def to_dict(self):
+        return {
+            'elapsed':    time.time()-self.starttime,
+            'counters':   dict(self.counters),
+            'histograms': dict([ (name,h.to_dict()) for name,h in
+                                 self.histograms.iteritems() ]),
+        }
+
+# writes telemetry objects as JSON, one section per keyword argument
+def write_telemetry(filename,**sections):
+    data = dict([ (name,t.to_dict()) for name,t in sections.iteritems()
+                  if not t is None ])
+    with open(filename,'w') as f:
+        json.dump(data,f,indent=2,sort_keys=True)
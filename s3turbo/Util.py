@@ -1,3 +1,5 @@
+import collections
+
 # 7 to 8 bit conversion
 def conv8_7(src):
     ret = []
@@ -17,6 +19,48 @@ def conv7_8(src):
         bit8 = bit8 >> 1
     return ret
 
+# byte-wise or of two equally long strings via long arithmetic
+def _or_bytes(a,b):
+    import binascii
+    if not len(a): return a
+    x = long(binascii.hexlify(a),16) | long(binascii.hexlify(b),16)
+    return binascii.unhexlify('%0*x' % (2*len(a),x))
+
+_SHL1 = ''.join([ chr((i << 1) & 0xff) for i in xrange(256) ])
+_SHR1 = ''.join([ chr(i >> 1) for i in xrange(256) ])
+_GETBIT = [ ''.join([ chr((i >> n) & 1)      for i in xrange(256) ])
+            for n in xrange(7) ]
+_PUTBIT = [ ''.join([ chr((i & 1) << n)      for i in xrange(256) ])
+            for n in xrange(7) ]
+
+# 7 to 8 bit conversion of whole payload, src holds groups of 8 bytes
+def conv7_8_all(src,ngroups=None):
+    src = bytearray(src)
+    if ngroups is None: ngroups = len(src)/8
+    src = str(src[:8*ngroups])
+    bit8 = src[7::8]
+    # all seven byte planes are combined in one go
+    planes = _or_bytes(
+        ''.join([ src[i::8].translate(_SHL1)  for i in xrange(7) ]),
+        ''.join([ bit8.translate(_GETBIT[i]) for i in xrange(7) ]))
+    ret = bytearray(7*ngroups)
+    for i in xrange(7):
+        ret[i::7] = planes[i*ngroups:(i+1)*ngroups]
+    return ret
+
+# 8 to 7 bit conversion of whole payload, src is padded to groups of 7 bytes
+def conv8_7_all(src):
+    src = bytearray(src)
+    ngroups = (len(src)+6)/7
+    src = str(src.ljust(7*ngroups,b'\x00'))
+    ret = bytearray(8*ngroups)
+    accum = b'\x00'*ngroups
+    for i in xrange(7):
+        ret[i::8] = src[i::7].translate(_SHR1)
+        accum = _or_bytes(accum,src[i::7].translate(_PUTBIT[i]))
+    ret[7::8] = accum
+    return ret
+
 # xor checksum of list
 def checksum(data):
     ret = 0
@@ -24,6 +68,19 @@ def checksum(data):
         ret ^= d
     return ret
 
+# xor checksum of a string or buffer via long arithmetic, folds the upper
+# half onto the lower one until a single byte is left
+def xor_checksum(data):
+    import binascii
+    n = len(data)
+    if not n: return 0
+    x = long(binascii.hexlify(data),16)
+    while n > 1:
+        low = n - n/2
+        x = (x >> 8*low) ^ (x & ((1 << 8*low)-1))
+        n = low
+    return int(x)
+
 # does nothing
 def noop(*args,**kwargs):
     return True
@@ -148,6 +205,36 @@ def ByteHandler(default): return ConversionHandler('<B',1,default)
 def WordHandler(default): return ConversionHandler('<H',2,default)
 def LongHandler(default): return ConversionHandler('<I',4,default)
 
+# single little-endian struct for an ordered mapping of handlers
+def compile_struct(attributes):
+    import struct
+    return struct.Struct('<'+''.join([ h.format.lstrip('<')
+                                       for h in attributes.itervalues() ]))
+
+# bounded mapping which discards the least recently used entries
+class LRUCache(object):
+    def __init__(self,maxsize):
+        self.maxsize = maxsize
+        self.data    = collections.OrderedDict()
+
+    def get(self,key,default=None):
+        if not key in self.data: return default
+        value = self.data.pop(key)
+        self.data[key] = value
+        return value
+
+    def put(self,key,value):
+        self.data.pop(key,None)
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self,key,default=None):
+        return self.data.pop(key,default)
+
+    def clear(self):
+        self.data.clear()
+
 # create timestamp for dump files
 def mktimestamp():
     from time import strftime
@@ -157,3 +244,12 @@ def list2str(l):
     try:
         return ''.join([chr(li) for li in l ])
     except: return 'error'
+
+def str2list(s):
+    return [ ord(c) for c in s ]
+
+# str copy of memoryview, buffer or bytearray, str is returned as is
+def to_str(data):
+    if isinstance(data,str):        return data
+    if isinstance(data,memoryview): return data.tobytes()
+    return str(data)
@@ -9,5 +9,5 @@ setup(name='s3turbo',
       author_email='joerg.mechnich@gmail.com',
       url='https://github.com/jmechnich/s3turbo',
       packages=['s3turbo'],
-      scripts=['s3dump_TXL','s3floppy','s3img','s3midi']
+      scripts=['s3bench','s3dump_TXL','s3floppy','s3img','s3midi']
 )
@@ -0,0 +1,55 @@
+import sys, time, types
+
+# fake pypm device, input delivers COUNT SysEx messages in 4 byte events
+class FakeInput(object):
+    def __init__(self,dev):
+        self.events = []
+        for k in xrange(FakeInput.COUNT):
+            self.events += [ (ev,k) for ev in events(k) ]
+
+    def Poll(self):
+        return len(self.events)
+
+    def Read(self,n):
+        data, self.events = self.events[:n], self.events[n:]
+        return data
+
+FakeInput.COUNT = 200
+
+# input with messages k arriving at absolute times TIMES[k]
+class DelayedInput(FakeInput):
+    def __init__(self,dev):
+        self.events = []
+        self.count  = 0
+
+    def Poll(self):
+        now = time.time()
+        while self.count < len(DelayedInput.TIMES) and \
+              DelayedInput.TIMES[self.count] <= now:
+            self.events += [ (ev,self.count) for ev in events(self.count) ]
+            self.count += 1
+        return FakeInput.Poll(self)
+
+DelayedInput.TIMES = []
+
+class FakeOutput(object):
+    def __init__(self,dev,latency): pass
+    def WriteSysEx(self,timestamp,msg): pass
+
+def message(k):
+    return [ 0xF0, 0x2F, k & 0x7F ] + [ 0x55 ] * 8 + [ 0xF7 ]
+
+def events(k):
+    msg = message(k)
+    return [ msg[i:i+4] for i in xrange(0,len(msg),4) ]
+
+fakepypm = types.ModuleType('pypm')
+fakepypm.Initialize = fakepypm.Terminate = lambda: None
+fakepypm.Input  = FakeInput
+fakepypm.Output = FakeOutput
+
+try:
+    import pypm
+except ImportError:
+    sys.modules['pypm'] = fakepypm
+import s3turbo.MidiHandler as MidiHandlerModule
@@ -0,0 +1,36 @@
+import time, unittest
+
+from fakepypm import DelayedInput, FakeInput, MidiHandlerModule, fakepypm, message
+
+class PollLatencyTest(unittest.TestCase):
+    def setUp(self):
+        self.pypm = MidiHandlerModule.pypm
+        MidiHandlerModule.pypm = fakepypm
+        fakepypm.Input = DelayedInput
+
+    def tearDown(self):
+        MidiHandlerModule.pypm = self.pypm
+        fakepypm.Input = FakeInput
+
+    # input is idle between messages, like between the packets of a dump
+    def check_latency(self,transport):
+        start = time.time() + 0.2
+        DelayedInput.TIMES = [ start + 0.05*k for k in xrange(10) ]
+        midi = MidiHandlerModule.MidiHandler()
+        midi.initialize(0,0,transport=transport)
+        latency = []
+        for k, due in enumerate(DelayedInput.TIMES):
+            self.assertTrue(midi.poll(1.))
+            self.assertEqual(midi.recv(),(k,message(k)))
+            latency.append(time.time()-due)
+        midi.stop()
+        self.assertTrue(max(latency) < 0.005,latency)
+
+    def test_latency_pipe(self):
+        self.check_latency('pipe')
+
+    def test_latency_ring(self):
+        self.check_latency('ring')
+
+if __name__ == '__main__':
+    unittest.main()
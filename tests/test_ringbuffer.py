@@ -0,0 +1,85 @@
+import threading, time, unittest
+
+from s3turbo.RingBuffer import RingBuffer
+from fakepypm import FakeInput, MidiHandlerModule, fakepypm, message
+
+class RingBufferTest(unittest.TestCase):
+    def test_empty(self):
+        ring = RingBuffer(64)
+        self.assertFalse(ring.poll(0))
+        self.assertFalse(ring.poll(0.01))
+        ring.send((1,[ 0xF8 ]))
+        self.assertTrue(ring.poll(0))
+        # poll does not consume the frame
+        self.assertTrue(ring.poll(0))
+        self.assertEqual(ring.recv(),(1,[ 0xF8 ]))
+        self.assertFalse(ring.poll(0))
+
+    def test_wraparound(self):
+        ring = RingBuffer(50)
+        for i in xrange(100):
+            msg = [ 0xF0 ] + [ i & 0x7F ] * (i % 20) + [ 0xF7 ]
+            ring.send((i,msg))
+            self.assertTrue(ring.poll(0))
+            self.assertEqual(ring.recv(),(i,msg))
+        self.assertEqual(ring.head.value,ring.tail.value)
+
+    def test_too_large(self):
+        ring = RingBuffer(32)
+        self.assertRaises(ValueError,ring.send,(0,[ 0 ] * 32))
+
+    # frames take 22 bytes, two of them fit
+    def test_full(self):
+        ring = RingBuffer(50)
+        ring.send((0,[ 1 ] * 10))
+        ring.send((1,[ 2 ] * 10))
+        sender = threading.Thread(target=ring.send,args=((2,[ 3 ] * 10),))
+        sender.start()
+        time.sleep(0.05)
+        # no room for a third frame until the first is received
+        self.assertTrue(sender.is_alive())
+        self.assertEqual(ring.recv(),(0,[ 1 ] * 10))
+        sender.join(1.)
+        self.assertFalse(sender.is_alive())
+        self.assertEqual(ring.recv(),(1,[ 2 ] * 10))
+        self.assertEqual(ring.recv(),(2,[ 3 ] * 10))
+
+class RingTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.pypm = MidiHandlerModule.pypm
+        self.size = RingBuffer.SIZE
+        MidiHandlerModule.pypm = fakepypm
+        RingBuffer.SIZE = 256
+
+    def tearDown(self):
+        MidiHandlerModule.pypm = self.pypm
+        RingBuffer.SIZE = self.size
+
+    def handler(self,msgfilter=[]):
+        midi = MidiHandlerModule.MidiHandler()
+        midi.initialize(0,0,msgfilter=msgfilter,transport='ring')
+        return midi
+
+    def test_receive(self):
+        midi = self.handler()
+        for k in xrange(FakeInput.COUNT):
+            self.assertTrue(midi.poll(1.))
+            timestamp, msg = midi.recv()
+            self.assertEqual(timestamp,k)
+            self.assertEqual(msg,message(k))
+        self.assertFalse(midi.poll(0.05))
+        midi.stop()
+
+    # input process is blocked on the full ring when stop is called
+    def test_stop_blocked(self):
+        midi = self.handler([ [ 0xF0, 0x2F, 0 ] ])
+        time.sleep(0.2)
+        stopper = threading.Thread(target=midi.stop)
+        stopper.start()
+        stopper.join(5.)
+        self.assertFalse(stopper.is_alive())
+        self.assertFalse(midi.recv_proc.is_alive())
+        self.assertEqual(midi.telemetry.counters['filtered_f02f00'],2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import cStringIO, os, shutil, tempfile, unittest
+
+from s3turbo.S3Image import S3Image
+
+class AddDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='s3test')
+        os.makedirs(os.path.join(self.tmpdir,'SUB'))
+        with open(os.path.join(self.tmpdir,'SUB','A.TXT'),'wb') as f:
+            f.write('hello')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_modify(self,contiguous):
+        img = S3Image(contiguous=contiguous)
+        img.add_directory(self.tmpdir)
+        img.mkdir('A:\\SUB\\NEWDIR')
+        img.copy('A:\\SUB\\B.TXT','data')
+        self.assertTrue(img.lookup(['SUB','NEWDIR']).is_dir())
+        self.assertEqual(
+            str(img.extract_file(img.lookup(['SUB','B       TXT']))),'data')
+        self.assertEqual(
+            str(img.extract_file(img.lookup(['SUB','A       TXT']))),'hello')
+
+    # directories created by add_directory must accept new entries
+    def test_modify_added(self):
+        self.check_modify(False)
+
+    def test_modify_added_contiguous(self):
+        self.check_modify(True)
+
+class ContiguousTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(prefix='s3test')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    # blank image is the same in both modes
+    def test_new_image(self):
+        img = S3Image(contiguous=True)
+        self.assertTrue(img.image is None)
+        img.write_to_file(self.filename)
+        out = cStringIO.StringIO()
+        S3Image().write(out)
+        with open(self.filename,'rb') as f:
+            self.assertEqual(f.read(),out.getvalue())
+
+    def test_read(self):
+        img = S3Image()
+        img.mkdir('A:\\DIR')
+        img.copy('A:\\DIR\\A.TXT','hello')
+        img.write_to_file(self.filename)
+        img = S3Image(contiguous=True)
+        img.read_from_file(self.filename)
+        self.assertEqual(len(img.image),img.bs.disk_size())
+        self.assertEqual(str(img.extract_file(
+            img.lookup(['DIR','A       TXT']))),'hello')
+        out = cStringIO.StringIO()
+        img.write(out)
+        with open(self.filename,'rb') as f:
+            self.assertEqual(f.read(),out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os, shutil, tempfile, unittest
+
+from s3turbo.S3Emulator import S3Emulator
+from s3turbo.S3Image    import S3Image
+from s3turbo.S3Session  import S3Request, S3Session, split_path
+from s3turbo.S3Turbo    import S3Exception
+
+class S3SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='s3test')
+        os.makedirs(os.path.join(self.tmpdir,'SUB','DIR'))
+        self.data = ''.join([ chr(i % 251) for i in xrange(1000) ])
+        for name, data in [ ('A.TXT','hello'), ('BIG.DAT',self.data) ]:
+            with open(os.path.join(self.tmpdir,'SUB',name),'wb') as f:
+                f.write(data)
+        img = S3Image()
+        img.add_directory(self.tmpdir)
+        self.img  = img
+        self.midi = S3Emulator(img,delay=0.001)
+        self.midi.initialize()
+        self.session = S3Session(self.midi,timeout=1.,idle=0.2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_split_path(self):
+        self.assertEqual(split_path('A:\\SUB\\BIG.DAT'),
+                         ('A:\\SUB\\','BIG     DAT'))
+
+    def test_status(self):
+        status = self.session.status().result()
+        self.assertEqual(status['iClass'],1)
+        self.assertEqual(status['TotalMem'],self.img.bs.disk_size())
+
+    def test_list_dir(self):
+        names = [ e.filename for e in
+                  self.session.list_dir('A:\\SUB').result() ]
+        self.assertEqual(sorted(names),
+                         [ 'A       TXT', 'BIG     DAT', 'DIR        ' ])
+        names = [ e.filename for e in
+                  self.session.list_dir('A:\\SUB','*TXT').result() ]
+        self.assertEqual(names,[ 'A       TXT' ])
+
+    def test_read_file(self):
+        s = self.session
+        small = s.read_file('A:\\SUB\\A.TXT')
+        big   = s.read_file('A:\\SUB\\BIG.DAT')
+        self.assertEqual(s.run(small,big),[ 'hello', self.data ])
+
+    # first chunk comes with the file header, the rest in packets
+    def test_chunks(self):
+        chunks = list(self.session.read_file('A:\\SUB\\BIG.DAT'))
+        self.assertEqual(len(chunks),6)
+        self.assertEqual(len(chunks[0]),6)
+        self.assertEqual(''.join(chunks),self.data)
+
+    def test_cancel(self):
+        s = self.session
+        r = s.read_file('A:\\SUB\\BIG.DAT')
+        queued = s.status()
+        next(iter(r))
+        self.assertTrue(r.cancel())
+        self.assertFalse(r.cancel())
+        self.assertEqual(r.state,S3Request.CANCELLED)
+        self.assertRaises(S3Exception,r.result)
+        # queued request runs after the cancelled one
+        self.assertEqual(queued.result()['iClass'],1)
+
+    def test_cancel_pending(self):
+        s = self.session
+        first, second = s.status(), s.status()
+        second.cancel()
+        self.assertEqual(first.result()['iClass'],1)
+        self.assertRaises(S3Exception,second.result)
+
+    def test_device_error(self):
+        r = self.session.read_file('A:\\SUB\\NOPE.DAT')
+        with self.assertRaises(S3Exception) as cm:
+            r.result()
+        self.assertEqual(str(cm.exception),
+                         'device error %d' % S3Emulator.ERR_NOTFOUND)
+        self.assertEqual(r.state,S3Request.FAILED)
+        # session is usable after an error
+        self.assertEqual(self.session.read_file('A:\\SUB\\A.TXT').result(),
+                         'hello')
+
+    def test_done_callback(self):
+        done = []
+        r = self.session.read_file('A:\\SUB\\A.TXT')
+        r.add_done_callback(done.append)
+        r.result()
+        self.assertEqual(done,[ r ])
+        r.add_done_callback(done.append)
+        self.assertEqual(done,[ r, r ])
+
+if __name__ == '__main__':
+    unittest.main()
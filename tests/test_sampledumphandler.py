@@ -0,0 +1,49 @@
+import unittest
+
+from s3turbo.SampleDumpHandler import SampleDumpHandler
+from s3turbo.Util import checksum
+
+def header(length):
+    return [ 0xF0, 0x7E, 0, 0x1, 0, 0, 14, 0, 0x10, 0,
+             length & 0x7F, (length >> 7) & 0x7F, length >> 14,
+             0, 0, 0, 0, 0, 0, 0x7F, 0xF7 ]
+
+def packet(number,bad=False):
+    msg = [ 0xF0, 0x7E, 0, 0x2, number ] + [ number ] * 120
+    return msg + [ checksum(msg[1:]) ^ bad, 0xF7 ]
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = SampleDumpHandler()
+        self.handler.parse(header(300))
+
+    def tearDown(self):
+        # nothing to save on exit
+        self.handler.data = []
+
+    def parse(self,*msgs):
+        return [ self.handler.parse(msg)[3] for msg in msgs ]
+
+    def retries(self):
+        return self.handler.telemetry.counters.get('retry',0)
+
+    def test_no_retry(self):
+        self.assertEqual(self.parse(packet(0),packet(1)),[ 0x7F, 0x7F ])
+        self.assertEqual(self.retries(),0)
+
+    # packet after a NAK is the resend of the rejected one
+    def test_resend_after_nak(self):
+        self.assertEqual(self.parse(packet(0),packet(1,True),packet(1)),
+                         [ 0x7F, 0x7E, 0x7F ])
+        self.assertEqual(self.retries(),1)
+        self.assertEqual(self.parse(packet(2,True),packet(2,True),packet(2)),
+                         [ 0x7E, 0x7E, 0x7F ])
+        self.assertEqual(self.retries(),3)
+        self.assertEqual(self.handler.packetcounter,3)
+
+    def test_repeated_packet(self):
+        self.assertEqual(self.parse(packet(0),packet(0)),[ 0x7F, 0x7F ])
+        self.assertEqual(self.retries(),1)
+
+if __name__ == '__main__':
+    unittest.main()
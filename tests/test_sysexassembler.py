@@ -0,0 +1,50 @@
+import unittest
+
+from s3turbo.MessageFilter  import MessageFilter
+from s3turbo.SysExAssembler import SysExAssembler
+
+class SysExAssemblerTest(unittest.TestCase):
+    def test_fragments(self):
+        a = SysExAssembler()
+        self.assertEqual(a.feed([ 0xF0, 0x2F, 1, 2 ],5),[])
+        self.assertEqual(a.feed([ 3, 0xF7, 0, 0 ],6),
+                         [ (5,[ 0xF0, 0x2F, 1, 2, 3, 0xF7 ]) ])
+
+    # pypm delivers real-time bytes as padded 4 byte events
+    def test_clock_event_in_sysex(self):
+        a = SysExAssembler()
+        out  = a.feed([ 0xF0, 0x2F, 1, 2 ])
+        out += a.feed([ 3, 4, 5, 6 ])
+        out += a.feed([ 0xF8, 0, 0, 0 ])
+        out += a.feed([ 7, 8, 0xF7, 0 ])
+        self.assertEqual(out,[ (0,[ 0xF8 ]),
+                               (0,[ 0xF0, 0x2F, 1, 2, 3, 4, 5, 6, 7, 8, 0xF7 ]) ])
+
+    def test_filtered_clock_event_in_sysex(self):
+        a = SysExAssembler(msgfilter=MessageFilter([ [ 0xF8 ] ]))
+        out  = a.feed([ 0xF0, 0x2F, 1, 2 ])
+        out += a.feed([ 0xF8, 0, 0, 0 ])
+        out += a.feed([ 3, 0xF7, 0, 0 ])
+        self.assertEqual(out,[ (0,[ 0xF0, 0x2F, 1, 2, 3, 0xF7 ]) ])
+        self.assertEqual(a.filter.dropped,[ 1 ])
+
+    def test_realtime_inside_fragment(self):
+        a = SysExAssembler()
+        self.assertEqual(a.feed([ 0xF0, 1, 0xFA, 2, 0xF7 ]),
+                         [ (0,[ 0xFA ]), (0,[ 0xF0, 1, 2, 0xF7 ]) ])
+
+    def test_overflow(self):
+        a = SysExAssembler(maxlen=16)
+        self.assertEqual(a.feed([ 0xF0 ] + [ 1 ]*20),[])
+        self.assertEqual(a.feed([ 1, 0xF7 ]),[])
+        self.assertEqual(a.feed([ 0xF0, 9, 0xF7 ]),[ (0,[ 0xF0, 9, 0xF7 ]) ])
+        self.assertEqual(a.overflows,1)
+
+    def test_incomplete(self):
+        a = SysExAssembler()
+        self.assertEqual(a.feed([ 0xF0, 1, 2 ]),[])
+        self.assertEqual(a.feed([ 0xF0, 3, 0xF7 ]),[ (0,[ 0xF0, 3, 0xF7 ]) ])
+        self.assertEqual(a.incomplete,1)
+
+if __name__ == '__main__':
+    unittest.main()
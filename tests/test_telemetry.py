@@ -0,0 +1,23 @@
+import unittest
+
+from s3turbo.Telemetry import Histogram
+
+class HistogramTest(unittest.TestCase):
+    def buckets(self,values):
+        h = Histogram()
+        for v in values: h.add(v)
+        return dict(h.to_dict()['buckets'])
+
+    # powers of two are the upper bound of their own bucket
+    def test_powers_of_two(self):
+        for e in xrange(64):
+            self.assertEqual(self.buckets([ 2**e ]),{ 2.**e: 1 })
+            self.assertEqual(self.buckets([ 2.**e ]),{ 2.**e: 1 })
+            self.assertEqual(self.buckets([ 2.**-e ]),{ 2.**-e: 1 })
+
+    def test_between(self):
+        self.assertEqual(self.buckets([ 0, 3, 5, 7, 0.75, 2**29+1 ]),
+                         { 0.: 1, 1.: 1, 4.: 1, 8.: 2, 2.**30: 1 })
+
+if __name__ == '__main__':
+    unittest.main()